@@ -0,0 +1,321 @@
+# === async_controller.py ===
+import asyncio
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+
+from config import serial_port, baudrate
+from gui.logger import log
+from serial_reader import ERROR_CODES
+from stream_decoder import StreamDecoder, merge_batches
+from teensy_controller import (
+    CMD_ACK, CMD_ERROR, CMD_PING, CMD_GET_STATUS, CMD_GET_DUTY, CMD_STOP_PWM,
+    CMD_SET_PWM_OUTPUT_PIN, CMD_SET_PWM_SENSING_PIN, CMD_SET_CURRENT_SENSING_PIN,
+    CMD_SET_PWM_FREQ, CMD_SET_PWM_ADC_RATE, CMD_SET_CURRENT_ADC_RATE,
+    CMD_SET_PWM_ADC_RES, CMD_SET_CURRENT_ADC_RES, CMD_SET_PWM_DEPTH,
+    CMD_SET_DUTY_ACK, CMD_SET_DUTY, CMD_SET_DUTY_FAST, CMD_SAVE_SETTINGS,
+    CMD_SOFT_RESET, CMD_START_STREAM, CMD_STOP_STREAM, CMD_START_AUTOMATION,
+    CMD_STOP_AUTOMATION, CMD_QUEUE_TRAJ_SEG, CMD_GET_TRAJ_STATUS, CMD_SOFT_RELEASE,
+    parse_status, parse_traj_state, percent_to_duty, traj_segment_payload,
+)
+
+
+class AsyncTeensyController:
+    """
+    asyncio counterpart of TeensySolenoidController.
+
+    The serial port is read from the event loop itself (loop.add_reader on
+    the port's file descriptor) where the platform allows it, otherwise by a
+    single executor task per controller. Writes go through a one-thread
+    executor per controller, so a full OS buffer never blocks the loop and
+    commands still leave in the order they were issued. One loop can
+    therefore drive many rigs:
+
+        rigs = [AsyncTeensyController(p) for p in ports]
+        await asyncio.gather(*(r.connect() for r in rigs))
+        await asyncio.gather(*(r.set_duty(512) for r in rigs))
+    """
+
+    def __init__(self, port=None, baudrate=baudrate, stream_queue_size=1000):
+        self.port = port or serial_port
+        self.baudrate = baudrate
+        self.ser = None
+        self.is_connected = False
+        self.decoder = StreamDecoder(parse_commands=True)
+        self.stream_queue = asyncio.Queue(maxsize=stream_queue_size)
+        self.dropped_batches = 0
+        self.pending = {}  # response key -> list of futures, oldest first
+        self.pending_order = []
+        self._loop = None
+        self._poll_task = None
+        self._fd = None
+        self._writer = None
+
+    # === Transport ===
+
+    async def connect(self, port=None, settle_timeout=2.0, transport=None):
+        if port:
+            self.port = port
+        if transport is not None:
+            self.port = self.port or getattr(transport, "port", None)
+        if not self.port:
+            raise Exception("No serial port specified")
+
+        self._loop = asyncio.get_running_loop()
+        if transport is not None:
+            self.ser = transport
+            self.ser.timeout = 0
+        else:
+            self.ser = serial.Serial(self.port, self.baudrate, timeout=0)
+        self.ser.reset_input_buffer()
+        self.decoder.reset()
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        try:
+            self._fd = self.ser.fileno()
+            self._loop.add_reader(self._fd, self._on_readable)
+        except (AttributeError, NotImplementedError, OSError):
+            # No selectable handle (e.g. Windows): poll from an executor
+            self._fd = None
+            self.ser.timeout = 0.05
+            self._poll_task = asyncio.ensure_future(self._poll_loop())
+
+        deadline = time.monotonic() + settle_timeout
+        while True:
+            try:
+                await self.ping(timeout=0.1)
+                break
+            except Exception:
+                if time.monotonic() >= deadline:
+                    await self.close()
+                    raise
+        self.is_connected = True
+        log.info(f"[Serial] {self.port} connected (async)")
+
+    async def close(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+        if self._poll_task:
+            self._poll_task.cancel()
+            self._poll_task = None
+        for fut in self.pending_order:
+            if not fut.done():
+                fut.set_exception(Exception("[Serial] Connection closed"))
+        self.pending.clear()
+        self.pending_order.clear()
+        if self._writer:
+            self._writer.shutdown(wait=False)
+            self._writer = None
+        if self.ser and self.ser.is_open:
+            self.ser.close()
+        self.is_connected = False
+
+    def _on_readable(self):
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except Exception as e:
+            log.error(f"[Serial] {self.port} read failed: {e}")
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+            return
+        if data:
+            self._feed(data)
+
+    async def _poll_loop(self):
+        while self.ser and self.ser.is_open:
+            data = await self._loop.run_in_executor(None, lambda: self.ser.read(self.ser.in_waiting or 1))
+            if data:
+                self._feed(data)
+
+    def _feed(self, data):
+        batch = self.decoder.feed(data)
+        for cmd_id, payload in batch.pop("commands"):
+            self._route(cmd_id, payload)
+        if len(batch["duty"]) or batch["time"]:
+            if self.stream_queue.full():
+                self.stream_queue.get_nowait()
+                self.dropped_batches += 1
+            self.stream_queue.put_nowait(batch)
+
+    def _route(self, cmd_id, payload):
+        if cmd_id == CMD_ERROR:
+            fut = self.pending_order[0] if self.pending_order else None
+        else:
+            key = payload[0] if cmd_id == CMD_ACK and payload else cmd_id
+            waiters = self.pending.get(key)
+            fut = waiters[0] if waiters else None
+        if fut is None:
+            log.debug(lambda: f"[Serial] Unsolicited packet: cmd=0x{cmd_id:02X}, payload={payload.hex()}")
+            return
+        self._forget(fut)
+        if cmd_id == CMD_ERROR:
+            code = payload[0] if payload else 0
+            fut.set_exception(Exception(f"[Serial] Device error 0x{code:02X} ({ERROR_CODES.get(code, 'unknown error')})"))
+        else:
+            fut.set_result((cmd_id, payload))
+
+    def _forget(self, fut):
+        for waiters in self.pending.values():
+            if fut in waiters:
+                waiters.remove(fut)
+                break
+        if fut in self.pending_order:
+            self.pending_order.remove(fut)
+
+    # === Commands ===
+
+    async def send_command(self, cmd_id, payload=b''):
+        if not self.ser or not self.ser.is_open:
+            raise RuntimeError("Serial connection not established.")
+        packet = bytes([cmd_id]) + payload
+        frame = bytes([len(packet)]) + packet + bytes([sum(packet) & 0xFF])
+        # A blocking write would stall every rig on the loop
+        await self._loop.run_in_executor(self._writer, self.ser.write, frame)
+
+    async def transact(self, cmd_id, payload=b'', timeout=1.0):
+        fut = self._loop.create_future()
+        self.pending.setdefault(cmd_id, []).append(fut)
+        self.pending_order.append(fut)
+        try:
+            await self.send_command(cmd_id, payload)
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            raise Exception(f"[Serial] No response to cmd 0x{cmd_id:02X}")
+        finally:
+            self._forget(fut)
+
+    async def command_ack(self, cmd_id, payload=b'', timeout=1.0):
+        await self._ack(cmd_id, payload, timeout)
+        return cmd_id
+
+    async def _ack(self, cmd_id, payload=b'', timeout=1.0):
+        resp_id, resp = await self.transact(cmd_id, payload, timeout=timeout)
+        if resp_id != CMD_ACK or not resp or resp[0] != cmd_id:
+            raise Exception(f"[Serial] Unexpected response to cmd 0x{cmd_id:02X}")
+        return resp
+
+    async def ping(self, timeout=1.0):
+        await self.command_ack(CMD_PING, timeout=timeout)
+        return True
+
+    async def stop_pwm(self):
+        await self.command_ack(CMD_STOP_PWM)
+        return True
+
+    async def get_status(self):
+        cmd_id, payload = await self.transact(CMD_GET_STATUS)
+        if cmd_id != CMD_GET_STATUS:
+            raise Exception("[Serial] Invalid status response")
+        return parse_status(payload)
+
+    async def get_duty(self):
+        cmd_id, payload = await self.transact(CMD_GET_DUTY)
+        if cmd_id != CMD_GET_DUTY or len(payload) != 2:
+            raise Exception("[Serial] Invalid duty response")
+        return struct.unpack(">H", payload)[0]
+
+    async def set_pwm_frequency(self, frequency_hz):
+        await self.command_ack(CMD_SET_PWM_FREQ, struct.pack(">I", int(frequency_hz)))
+
+    async def set_pwm_output_pin(self, pin):
+        await self.command_ack(CMD_SET_PWM_OUTPUT_PIN, struct.pack("B", pin))
+
+    async def set_pwm_sensing_pin(self, pin):
+        await self.command_ack(CMD_SET_PWM_SENSING_PIN, struct.pack("B", pin))
+
+    async def set_current_sensing_pin(self, pin):
+        await self.command_ack(CMD_SET_CURRENT_SENSING_PIN, struct.pack("B", pin))
+
+    async def set_pwm_adc_rate(self, rate_hz):
+        await self.command_ack(CMD_SET_PWM_ADC_RATE, struct.pack(">H", rate_hz))
+
+    async def set_current_adc_rate(self, rate_hz):
+        await self.command_ack(CMD_SET_CURRENT_ADC_RATE, struct.pack(">H", rate_hz))
+
+    async def set_pwm_adc_resolution(self, bits):
+        await self.command_ack(CMD_SET_PWM_ADC_RES, struct.pack("B", bits))
+
+    async def set_current_adc_resolution(self, bits):
+        await self.command_ack(CMD_SET_CURRENT_ADC_RES, struct.pack("B", bits))
+
+    async def set_pwm_depth(self, bits):
+        await self.command_ack(CMD_SET_PWM_DEPTH, struct.pack("B", bits))
+
+    async def set_duty(self, duty):
+        await self.send_command(CMD_SET_DUTY, struct.pack(">H", duty))
+
+    async def set_duty_ack(self, duty):
+        await self.command_ack(CMD_SET_DUTY_ACK, struct.pack(">H", duty))
+
+    async def set_duty_fast(self, duty):
+        await self.send_command(CMD_SET_DUTY_FAST, struct.pack(">H", duty))
+
+    async def send_duty(self, percent):
+        await self.set_duty(percent_to_duty(percent))
+
+    async def save_settings(self):
+        await self.command_ack(CMD_SAVE_SETTINGS)
+
+    async def soft_reset(self):
+        await self.send_command(CMD_SOFT_RESET)
+
+    async def queue_traj_segment(self, start_percent, end_percent, duration_ms, shape=1):
+        payload = traj_segment_payload(start_percent, end_percent, duration_ms, shape)
+        await self.send_command(CMD_QUEUE_TRAJ_SEG, payload)
+
+    async def queue_traj_segment_ack(self, start_percent, end_percent, duration_ms, shape=1):
+        """Firmware 2.3+: returns the queue state from the ACK; ERR_QUEUE_FULL raises."""
+        payload = traj_segment_payload(start_percent, end_percent, duration_ms, shape)
+        return parse_traj_state((await self._ack(CMD_QUEUE_TRAJ_SEG, payload))[1:])
+
+    async def get_traj_status(self):
+        """Firmware 2.3+: {"free", "played", "running"} of the trajectory queue."""
+        cmd_id, payload = await self.transact(CMD_GET_TRAJ_STATUS)
+        if cmd_id != CMD_GET_TRAJ_STATUS:
+            raise Exception("[Serial] Invalid trajectory status response")
+        return parse_traj_state(payload)
+
+    async def start_automation(self):
+        await self.send_command(CMD_START_AUTOMATION)
+
+    async def start_automation_ack(self):
+        return parse_traj_state((await self._ack(CMD_START_AUTOMATION))[1:])
+
+    async def stop_automation(self):
+        await self.send_command(CMD_STOP_AUTOMATION)
+
+    async def stop_automation_ack(self):
+        """Firmware 2.3+: also clears the queue and the started-segment count."""
+        return parse_traj_state((await self._ack(CMD_STOP_AUTOMATION))[1:])
+
+    async def send_soft_release(self, start_percent, n_steps, freq_hz, power_index):
+        payload = (
+            percent_to_duty(start_percent, invert=False).to_bytes(2, "big") +
+            int(n_steps).to_bytes(2, "big") +
+            int(freq_hz).to_bytes(2, "big") +
+            int(power_index).to_bytes(1, "big")
+        )
+        await self.send_command(CMD_SOFT_RELEASE, payload)
+
+    # === Streaming ===
+
+    async def start_streaming(self):
+        while not self.stream_queue.empty():
+            self.stream_queue.get_nowait()
+        await self.command_ack(CMD_START_STREAM)
+
+    async def stop_streaming(self):
+        await self.command_ack(CMD_STOP_STREAM)
+
+    async def stream_batches(self):
+        """
+        Async iterator over stream batches (StreamDecoder dicts). Batches that
+        queued up since the last iteration are merged into one.
+        """
+        while True:
+            batches = [await self.stream_queue.get()]
+            while not self.stream_queue.empty():
+                batches.append(self.stream_queue.get_nowait())
+            yield merge_batches(batches)
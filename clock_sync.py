@@ -0,0 +1,124 @@
+# === clock_sync.py ===
+from collections import deque
+
+import numpy as np
+
+MICROS_WRAP = 1 << 32
+# Crystal tolerance is a few tens of ppm; anything beyond this is arrival
+# jitter in the first few sync points, not drift.
+MAX_DRIFT = 500e-6
+# Device time the sync window must span before the measured sample rate
+# replaces the nominal one
+MIN_RATE_SPAN = 0.25
+
+
+class ClockSync:
+    """
+    Recovers per-sample host timestamps from the Teensy's time sync packets.
+
+    Each sync pairs the device's micros() with the host time its bytes
+    arrived. A least-squares line over the last `window` pairs maps device
+    time to host time (offset + drift); micros() wraps every ~71.6 minutes
+    and is unwrapped to a 64-bit count first. Samples are placed on the
+    device timeline from the ADC rate, anchored at the most recent sync, so
+    the per-sample work is a single vectorized affine transform. The rate
+    starts at the configured value and is replaced by the one measured
+    between syncs once the window spans MIN_RATE_SPAN.
+    """
+
+    def __init__(self, sample_rate, window=64):
+        self.sample_rate = float(sample_rate)
+        self.points = deque(maxlen=window)  # (sample index, device s, host s)
+        self.reset()
+
+    def reset(self):
+        self.points.clear()
+        self.wraps = 0
+        self.last_micros = None
+        self.device_origin = None  # unwrapped micros of the first sync
+        self.host_origin = None
+        self.anchor = None         # (sample index, device s) of the latest sync
+        self.slope = 1.0
+        self.intercept = 0.0
+        self.rate = self.sample_rate
+        self.residual = 0.0
+        self.syncs = 0
+        self.last_time = None
+
+    @property
+    def locked(self):
+        return self.anchor is not None
+
+    def unwrap(self, micros):
+        if self.last_micros is not None and micros < self.last_micros - MICROS_WRAP // 2:
+            self.wraps += 1
+        self.last_micros = micros
+        return micros + self.wraps * MICROS_WRAP
+
+    def add_sync(self, micros, host_time, sample_index):
+        """
+        Add one time sync. sample_index is the number of samples received
+        before the sync packet.
+        """
+        us = self.unwrap(micros)
+        if self.device_origin is None:
+            self.device_origin = us
+            self.host_origin = host_time
+        device_s = (us - self.device_origin) * 1e-6
+        self.points.append((sample_index, device_s, host_time - self.host_origin))
+        self.anchor = (sample_index, device_s)
+        self.syncs += 1
+        self._fit()
+
+    def _fit(self):
+        index, x, y = np.array(self.points).T
+        if x[-1] - x[0] >= MIN_RATE_SPAN and index[-1] > index[0]:
+            self.rate = float((index[-1] - index[0]) / (x[-1] - x[0]))
+        if len(x) > 1 and np.ptp(x) > 0:
+            slope = np.polyfit(x, y, 1)[0]
+            self.slope = float(np.clip(slope, 1.0 - MAX_DRIFT, 1.0 + MAX_DRIFT))
+        self.intercept = float(np.mean(y - self.slope * x))
+        self.residual = float(np.sqrt(np.mean((y - self.slope * x - self.intercept) ** 2)))
+
+    def device_to_host(self, device_s, origin=0.0):
+        """Host time (minus origin) of device times in seconds since the first sync."""
+        # Offsets are combined before the samples are added, so times
+        # relative to origin keep full float64 resolution
+        return (self.host_origin - origin) + self.intercept + self.slope * np.asarray(device_s)
+
+    def timestamps(self, first_index, n, received, origin=0.0):
+        """
+        Host timestamps, relative to origin, for samples first_index ..
+        first_index + n - 1. Before the first sync the batch is spread back
+        from its arrival time at the nominal rate. Timestamps never go
+        backwards, even when a new sync moves the fit.
+        """
+        k = np.arange(n, dtype=np.float64)
+        if self.anchor is None:
+            t = (received - origin) - (n - 1 - k) / self.sample_rate
+        else:
+            anchor_index, anchor_s = self.anchor
+            device_s = anchor_s + (first_index - anchor_index + k) / self.rate
+            t = self.device_to_host(device_s, origin)
+        if self.last_time is not None and n and t[0] < self.last_time:
+            t = np.maximum(t, self.last_time)
+        if n:
+            self.last_time = t[-1]
+        return t
+
+    def stats(self):
+        """
+        Current fit: offset (s, host - device), drift (ppm), residual jitter
+        (us) and the measured sample rate (Hz).
+        """
+        offset = None
+        if self.host_origin is not None:
+            offset = self.host_origin + self.intercept - self.device_origin * 1e-6
+        return {
+            "syncs": self.syncs,
+            "wraps": self.wraps,
+            "offset_s": offset,
+            "drift_ppm": (self.slope - 1.0) * 1e6,
+            "jitter_us": self.residual * 1e6,
+            "sample_rate": self.rate,
+        }
@@ -0,0 +1,97 @@
+# === decimate.py ===
+import numpy as np
+
+DECIMATION_METHODS = ("minmax", "lttb")
+
+
+def _grid(values, k):
+    # values padded with the last one and reshaped to rows of k
+    n = len(values)
+    rows = -(-n // k)
+    if rows * k != n:
+        padded = np.empty(rows * k, dtype=values.dtype)
+        padded[:n] = values
+        padded[n:] = values[-1]
+        values = padded
+    return values.reshape(rows, k)
+
+
+def minmax_indices(y, buckets):
+    """
+    Indices of the minimum and maximum of y in each of `buckets` equal
+    slices, in index order (about 2 * buckets indices). Peaks and edges
+    survive however far the series is decimated.
+    """
+    n = len(y)
+    if n <= 2 * buckets:
+        return np.arange(n)
+    k = -(-n // buckets)
+    grid = _grid(y, k)
+    base = np.arange(len(grid)) * k
+    lo = base + grid.argmin(axis=1)
+    hi = base + grid.argmax(axis=1)
+    idx = np.sort(np.stack((lo, hi), axis=1), axis=1).ravel()
+    idx = np.minimum(idx, n - 1)
+    # Flat buckets give the same index twice
+    keep = np.empty(len(idx), dtype=bool)
+    keep[0] = True
+    keep[1:] = idx[1:] != idx[:-1]
+    return idx[keep]
+
+
+def lttb_indices(t, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets style selection: from each bucket keep
+    the point that spans the largest triangle with its neighbour buckets.
+    The previous bucket is represented by its mean rather than by the
+    point picked there, which makes buckets independent, so the whole
+    selection is a handful of array operations instead of a loop.
+    Smoother than min/max for slow signals.
+    """
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    k = -(-(n - 2) // (n_out - 2))
+    tg = _grid(np.asarray(t[1:n - 1], dtype=np.float64), k)
+    yg = _grid(np.asarray(y[1:n - 1], dtype=np.float64), k)
+    mean_t = tg.mean(axis=1)
+    mean_y = yg.mean(axis=1)
+    prev_t = np.concatenate(([t[0]], mean_t[:-1]))[:, None]
+    prev_y = np.concatenate(([y[0]], mean_y[:-1]))[:, None]
+    next_t = np.concatenate((mean_t[1:], [t[n - 1]]))[:, None]
+    next_y = np.concatenate((mean_y[1:], [y[n - 1]]))[:, None]
+    area = np.abs((prev_t - next_t) * (yg - prev_y) - (prev_t - tg) * (next_y - prev_y))
+    picks = 1 + np.arange(len(tg)) * k + area.argmax(axis=1)
+    picks = np.minimum(picks, n - 2)
+    return np.unique(np.concatenate(([0], picks, [n - 1])))
+
+
+def gather(values, idx, buf=None):
+    """
+    values[idx] as float64, written into the front of buf when it is large
+    enough (returns a view of it), otherwise into a new array.
+    """
+    n = len(idx)
+    if buf is None or len(buf) < n:
+        return np.asarray(values[idx], dtype=np.float64)
+    out = buf[:n]
+    if values.dtype == np.float64:
+        np.take(values, idx, out=out)
+    else:
+        out[:] = values[idx]
+    return out
+
+
+def decimate(t, y, width, method="minmax", out=None):
+    """
+    Reduce (t, y) to about 2 * width points for a plot `width` pixels wide.
+    Returns (t, y) as float64 arrays; with out=(t_buf, y_buf) they are
+    views of those buffers (up to 2 * width points are written), so a
+    caller redrawing every frame can keep reusing the same memory.
+    """
+    if method == "lttb":
+        idx = lttb_indices(t, y, 2 * width)
+    else:
+        idx = minmax_indices(y, width)
+    t_buf, y_buf = out if out is not None else (None, None)
+    return gather(t, idx, t_buf), gather(y, idx, y_buf)
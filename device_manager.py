@@ -0,0 +1,183 @@
+# === device_manager.py ===
+import re
+import threading
+import time
+
+import numpy as np
+
+from gui.logger import log
+from stream_handler import StreamHandler
+from teensy_controller import TeensySolenoidController
+
+
+class DeviceManager:
+    """
+    Keeps one TeensySolenoidController (and one StreamHandler while
+    streaming) per serial port, so several rigs can run side by side.
+    Each device has its own reader and stream thread, so throughput scales
+    with the number of devices instead of sharing one serial loop.
+    """
+
+    def __init__(self, primary=None):
+        self.devices = {}   # port -> controller
+        self.handlers = {}  # port -> StreamHandler
+        self.lock = threading.Lock()
+        self.session_start = None
+        self.primary = primary
+
+    def _adopt_primary(self):
+        # The GUI connects the primary controller on its own; pick it up
+        # once it has a port.
+        if self.primary is not None and self.primary.port:
+            self.devices.setdefault(self.primary.port, self.primary)
+
+    def ports(self):
+        with self.lock:
+            self._adopt_primary()
+            return list(self.devices)
+
+    def connected(self):
+        with self.lock:
+            self._adopt_primary()
+            return {port: c for port, c in self.devices.items() if c.is_connected}
+
+    def connect(self, ports):
+        """
+        Open every port in parallel. Returns {port: exception} for the ones
+        that failed to connect.
+        """
+        def open_port(port):
+            with self.lock:
+                self._adopt_primary()
+                controller = self.devices.get(port)
+                if controller is None:
+                    controller = TeensySolenoidController(port, show_status=False)
+                    self.devices[port] = controller
+            if not controller.is_connected:
+                controller.connect(port)
+            log.info(f"[Devices] Connected {port}")
+
+        failures = self._run_parallel(open_port, ports, sync=False)
+        for port, error in failures.items():
+            log.error(f"[Devices] Failed to connect {port}: {error}")
+            with self.lock:
+                if self.devices.get(port) is not self.primary:
+                    self.devices.pop(port, None)
+        return failures
+
+    def disconnect(self, ports=None):
+        ports = self.ports() if ports is None else list(ports)
+        self.stop_streaming(ports)
+        for port in ports:
+            with self.lock:
+                controller = self.devices.get(port)
+                if controller is not self.primary:
+                    self.devices.pop(port, None)
+            if controller is not None:
+                controller.close()
+
+    def _run_parallel(self, fn, ports, sync=True):
+        """
+        Run fn(port) on one thread per port. With sync=True the threads are
+        released together from a barrier, so the commands leave the host
+        within a few microseconds of each other.
+        Returns {port: exception} for the calls that raised.
+        """
+        ports = list(ports)
+        if not ports:
+            return {}
+        barrier = threading.Barrier(len(ports)) if sync else None
+        failures = {}
+
+        def worker(port):
+            try:
+                if barrier is not None:
+                    barrier.wait()
+                fn(port)
+            except Exception as e:
+                failures[port] = e
+
+        threads = [threading.Thread(target=worker, args=(p,), daemon=True) for p in ports]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return failures
+
+    def broadcast(self, method, *args, ports=None, **kwargs):
+        """
+        Call controller.<method>(*args, **kwargs) on every connected device
+        at the same moment. Returns {port: exception} for failures.
+        """
+        targets = self.connected()
+        if ports is not None:
+            targets = {p: c for p, c in targets.items() if p in ports}
+        failures = self._run_parallel(
+            lambda port: getattr(targets[port], method)(*args, **kwargs), targets)
+        for port, error in failures.items():
+            log.error(f"[Devices] {method} failed on {port}: {error}")
+        return failures
+
+    def send_duty(self, percent, ports=None):
+        return self.broadcast("send_duty", percent, ports=ports)
+
+    def stop_pwm(self, ports=None):
+        return self.broadcast("stop_pwm", ports=ports)
+
+    def queue_traj_segment(self, start_percent, end_percent, duration_ms, shape=1, ports=None):
+        return self.broadcast("queue_traj_segment", start_percent, end_percent, duration_ms,
+                              shape=shape, ports=ports)
+
+    def start_automation(self, ports=None):
+        return self.broadcast("start_automation", ports=ports)
+
+    # === Streaming ===
+
+    def start_streaming(self, ports=None, binary_dir="stream_data"):
+        """Start one StreamHandler per device, all on a shared time base."""
+        targets = self.connected()
+        if ports is not None:
+            targets = {p: c for p, c in targets.items() if p in ports}
+        with self.lock:
+            for port, controller in targets.items():
+                if port not in self.handlers:
+                    name = re.sub(r"[^A-Za-z0-9]+", "_", port).strip("_")
+                    self.handlers[port] = StreamHandler(
+                        controller, binary_dir=binary_dir, prefix=f"stream_{name}")
+            handlers = {p: self.handlers[p] for p in targets}
+        self.session_start = time.time()
+        return self._run_parallel(lambda port: handlers[port].start(start_time=self.session_start),
+                                  handlers)
+
+    def stop_streaming(self, ports=None):
+        with self.lock:
+            if ports is None:
+                ports = list(self.handlers)
+            handlers = {p: self.handlers.pop(p) for p in ports if p in self.handlers}
+        return self._run_parallel(lambda port: handlers[port].stop(), handlers, sync=False)
+
+    def get_samples_by_time(self, t0, t1):
+        """Per-device samples in [t0, t1] on the shared session timeline."""
+        with self.lock:
+            handlers = dict(self.handlers)
+        return {port: h.get_samples_by_time(t0, t1) for port, h in handlers.items()}
+
+    def get_merged_samples(self, t0, t1):
+        """
+        All devices interleaved into one time-ordered stream.
+        Returns (timestamps, device_index, duty, current, ports) where
+        device_index points into ports.
+        """
+        per_device = self.get_samples_by_time(t0, t1)
+        ports = list(per_device)
+        if not ports:
+            empty = np.empty(0)
+            return empty, empty.astype(np.intp), empty, empty, ports
+
+        ts = np.concatenate([np.asarray(per_device[p][0], dtype=np.float64) for p in ports])
+        index = np.concatenate([np.full(len(per_device[p][0]), i, dtype=np.intp)
+                                for i, p in enumerate(ports)])
+        duty = np.concatenate([np.asarray(per_device[p][1]) for p in ports])
+        current = np.concatenate([np.asarray(per_device[p][2]) for p in ports])
+        order = np.argsort(ts, kind="stable")
+        return ts[order], index[order], duty[order], current[order], ports
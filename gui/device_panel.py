@@ -10,6 +10,8 @@ REFRESH_BUTTON_TAG = "serial_refresh_button"
 STATUS_LABEL = "Unconnected"
 STATUS_BUTTON_TAG = "serial_status_button"
 FREQ_CONTROL_TAG = "pwm_freq_field"
+RIG_LIST_TAG = "rig_port_list"
+RIG_STATUS_TAG = "rig_status_text"
 
 def get_available_ports():
     return [port.device for port in serial.tools.list_ports.comports()]
@@ -20,8 +22,38 @@ def refresh_ports():
     if ports:
         dpg.set_value(PORT_COMBO_TAG, ports[0])
 
-def on_refresh_pressed():
+def on_refresh_pressed(sender=None, app_data=None, user_data=None):
     refresh_ports()
+    if user_data is not None:
+        refresh_rig_list(user_data)
+
+def refresh_rig_list(manager):
+    if not dpg.does_item_exist(RIG_LIST_TAG):
+        return
+    connected = manager.connected()
+    dpg.delete_item(RIG_LIST_TAG, children_only=True)
+    for port in get_available_ports():
+        dpg.add_checkbox(label=port, default_value=port in connected,
+                         user_data=port, parent=RIG_LIST_TAG)
+
+def on_connect_rigs(sender, app_data, user_data):
+    manager = user_data
+    selected = [dpg.get_item_user_data(item)
+                for item in dpg.get_item_children(RIG_LIST_TAG, 1)
+                if dpg.get_value(item)]
+    failures = manager.connect(selected)
+    connected = len(manager.connected())
+    if failures:
+        dpg.set_value(RIG_STATUS_TAG, f"{connected} connected, failed: {', '.join(failures)}")
+    else:
+        dpg.set_value(RIG_STATUS_TAG, f"{connected} connected")
+
+def on_disconnect_rigs(sender, app_data, user_data):
+    manager = user_data
+    # The primary controller stays under the Device Status button's control
+    manager.disconnect([p for p, c in manager.connected().items() if c is not manager.primary])
+    dpg.set_value(RIG_STATUS_TAG, f"{len(manager.connected())} connected")
+    refresh_rig_list(manager)
 
 def _confirm_disconnect(controller):
     dpg.delete_item("confirm_disconnect")
@@ -240,7 +272,7 @@ def on_pwm_freq_changed(sender, app_data, user_data=None):
     print(f"[GUI] PWM frequency changed to: {new_freq}")
     # TODO: Send real-time update to Teensy using controller
 
-def create_serial_port_panel(controller):
+def create_serial_port_panel(controller, manager=None):
     with dpg.group(tag=PORT_PANEL_CONTENT_TAG):
         dpg.add_text("Serial Port")
         dpg.add_separator()
@@ -254,7 +286,8 @@ def create_serial_port_panel(controller):
                 tag=PORT_COMBO_TAG,
                 width=220
             )
-            dpg.add_button(label="Rescan", callback=on_refresh_pressed, tag=REFRESH_BUTTON_TAG)
+            dpg.add_button(label="Rescan", callback=on_refresh_pressed, user_data=manager,
+                           tag=REFRESH_BUTTON_TAG)
         dpg.add_spacer(height=10)
         with dpg.group(horizontal=True):        
             dpg.add_text("Device Status")
@@ -262,4 +295,13 @@ def create_serial_port_panel(controller):
                            tag=STATUS_BUTTON_TAG,
                            callback=None)
             dpg.bind_item_theme(STATUS_BUTTON_TAG, "status_theme_disconnected")
+        if manager is not None:
+            dpg.add_spacer(height=10)
+            with dpg.collapsing_header(label="Rigs", default_open=False):
+                dpg.add_group(tag=RIG_LIST_TAG)
+                with dpg.group(horizontal=True):
+                    dpg.add_button(label="Connect Selected", callback=on_connect_rigs, user_data=manager)
+                    dpg.add_button(label="Disconnect", callback=on_disconnect_rigs, user_data=manager)
+                dpg.add_text("", tag=RIG_STATUS_TAG)
+            refresh_rig_list(manager)
         dpg.add_separator()
\ No newline at end of file
@@ -1,17 +1,50 @@
+from collections import deque
 from datetime import datetime
+import time
 import dearpygui.dearpygui as dpg
 
+# Lines kept per text widget
+LOG_HISTORY = {
+    "log_window": 100,
+    "debug_log": 200,
+    "incoming_log": 200,
+    "outgoing_log": 200,
+}
+# Lines waiting for the next flush; when the GUI falls far behind, the
+# oldest are dropped (they would scroll out of view anyway)
+PENDING_MAX = 4096
+# Sinks that only receive lines while their widget is on screen
+GATED_SINKS = ("debug_log", "incoming_log", "outgoing_log")
+
+
 class DPGLogger:
+    """
+    Log calls only queue the line and return, so the serial thread never
+    touches DearPyGui or rebuilds the log text. flush() runs once per frame
+    on the render thread: it formats the queued lines, moves them into
+    fixed-size deques and updates each changed widget with a single
+    set_value.
+
+    A message may be a string, a %-format with args, or a callable
+    (called with args) that builds the text; formatting only happens in
+    flush(), and only for sinks that are enabled and visible, so hot paths
+    can log packets for free:
+
+        log.outgoing(lambda: packet.hex(" ").upper())
+        log.debug(lambda: f"[Serial] Sent: payload={payload.hex()}")
+    """
+
     def __init__(self):
         self.LOG_LEVELS = {
             "info": True,
             "error": True,
             "debug": False
         }
-        self.log_buffer = {
-            "log_window": [],
-            "debug_window": []
-        }
+        self.log_buffer = {tag: deque(maxlen=size) for tag, size in LOG_HISTORY.items()}
+        self.pending = deque(maxlen=PENDING_MAX)  # appends are thread-safe
+        # Refreshed every flush; until the first one nothing is known, so
+        # lines logged while the GUI is being built are kept
+        self.visible = dict.fromkeys(GATED_SINKS, True)
 
     def create_log_panel(self):
         with dpg.group():
@@ -32,28 +65,60 @@ class DPGLogger:
     def toggle_log_level(self, level, enabled):
         self.LOG_LEVELS[level] = enabled
 
-    def _log(self, message, level):
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        full_message = f"[{timestamp}] {message}"
-
-        # Store in main log
-        self.log_buffer["log_window"].append(full_message)
-        dpg.set_value("log_window", "\n".join(self.log_buffer["log_window"][-100:]))
-
-        # Store in debug log if enabled
-        if self.LOG_LEVELS.get(level, False):
-            debug_message = f"[{timestamp}] [{level.upper()}] {message}"
-            self.log_buffer["debug_window"].append(debug_message)
-            dpg.set_value("debug_log", "\n".join(self.log_buffer["debug_window"][-200:]))
-
-    def info(self, message):
-        self._log(message, "info")
-
-    def error(self, message):
-        self._log(message, "error")
-
-    def debug(self, message):
-        self._log(message, "debug")
+    def enabled(self, level):
+        """Whether messages of a level (or packets: "incoming"/"outgoing") are shown anywhere."""
+        if level in ("incoming", "outgoing"):
+            return self.visible[f"{level}_log"]
+        if level == "debug":
+            return self.LOG_LEVELS["debug"]
+        return True
+
+    def _log(self, message, level, args):
+        tags = ("log_window",)
+        if self.LOG_LEVELS.get(level, False) and self.visible["debug_log"]:
+            tags += ("debug_log",)
+        self.pending.append((tags, level, time.time(), message, args))
+
+    def flush(self):
+        """Format queued lines into the log widgets; call once per frame from the render thread."""
+        changed = set()
+        for _ in range(len(self.pending)):
+            tags, level, when, message, args = self.pending.popleft()
+            try:
+                if callable(message):
+                    text = message(*args)
+                else:
+                    text = message % args if args else message
+            except Exception as e:
+                # A bad formatter must not take down the render loop
+                text = f"<log formatting failed: {e!r}>"
+            if level is not None:
+                stamp = datetime.fromtimestamp(when).strftime("%H:%M:%S")
+            for tag in tags:
+                if tag == "debug_log":
+                    line = f"[{stamp}] [{level.upper()}] {text}"
+                elif tag == "log_window":
+                    line = f"[{stamp}] {text}"
+                else:
+                    line = text
+                self.log_buffer[tag].append(line)
+                changed.add(tag)
+        for tag in changed:
+            if dpg.does_item_exist(tag):
+                dpg.set_value(tag, "\n".join(self.log_buffer[tag]))
+        for tag in GATED_SINKS:
+            self.visible[tag] = bool(dpg.does_item_exist(tag) and dpg.is_item_visible(tag))
+
+    def info(self, message, *args):
+        self._log(message, "info", args)
+
+    def error(self, message, *args):
+        self._log(message, "error", args)
+
+    def debug(self, message, *args):
+        # Nothing is queued or formatted while debug logging is off
+        if self.LOG_LEVELS["debug"]:
+            self._log(message, "debug", args)
 
     def create_packet_monitor(self):
         with dpg.group(horizontal=True):
@@ -66,16 +131,13 @@ class DPGLogger:
                 dpg.add_text(">> Incoming")
                 dpg.add_input_text(multiline=True, readonly=True, tag="incoming_log", height=170)
 
-        self.log_buffer["incoming_log"] = []
-        self.log_buffer["outgoing_log"] = []
-
-    def incoming(self, message):
-        self.log_buffer["incoming_log"].append(message)
-        dpg.set_value("incoming_log", "\n".join(self.log_buffer["incoming_log"][-200:]))
+    def incoming(self, message, *args):
+        if self.visible["incoming_log"]:
+            self.pending.append((("incoming_log",), None, None, message, args))
 
-    def outgoing(self, message):
-        self.log_buffer["outgoing_log"].append(message)
-        dpg.set_value("outgoing_log", "\n".join(self.log_buffer["outgoing_log"][-200:]))
+    def outgoing(self, message, *args):
+        if self.visible["outgoing_log"]:
+            self.pending.append((("outgoing_log",), None, None, message, args))
 
 
 log = DPGLogger()
@@ -0,0 +1,134 @@
+import threading
+import time
+
+from gui.logger import log
+
+# Started schedulers, for the render loop and shutdown
+_active = []
+
+
+def flush_schedulers():
+    """Apply prepared plot updates; call once per frame from the render thread."""
+    for scheduler in list(_active):
+        scheduler.flush()
+
+
+def stop_schedulers():
+    """Stop every scheduler's worker; call before dpg.destroy_context()."""
+    for scheduler in list(_active):
+        scheduler.stop()
+
+
+class PlotScheduler:
+    """
+    Runs plot refreshes at a fixed rate instead of from a callback
+    re-registered on every rendered frame.
+
+    Each job is an apply function, a generation function and optionally a
+    prepare function. A background thread checks the generations at the
+    refresh rate; when one differs from the last handled (e.g. the
+    handler's sample count and the view settings), it runs prepare, which
+    does the heavy work (decimating into arrays) without touching
+    DearPyGui, so an idle stream costs nothing. flush(), called once per
+    frame from the render loop like log.flush(), passes the result to
+    apply, which hands it to DearPyGui. A job is not prepared again until
+    its last result was applied, so buffers can be reused safely.
+
+    sync, if given, runs at the start of every flush() to copy the widget
+    state the jobs depend on into plain attributes for the worker.
+    """
+
+    def __init__(self, rate_hz=30.0, sync=None):
+        self.rate_hz = rate_hz
+        self.sync = sync
+        self.jobs = []  # [apply, generation, prepare, last generation, pending result]
+        self.lock = threading.Lock()
+        self.updates = 0
+        self.skipped = 0
+        self.last_error = None
+        self.running = False
+        self.thread = None
+
+    def add(self, apply, generation, prepare=None):
+        self.jobs.append([apply, generation, prepare, None, None])
+
+    def set_rate(self, rate_hz):
+        self.rate_hz = max(1.0, float(rate_hz))
+
+    def invalidate(self):
+        """Force every job to run on the next tick."""
+        for job in self.jobs:
+            job[3] = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        _active.append(self)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self in _active:
+            _active.remove(self)
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        self.thread = None
+
+    def tick(self):
+        """Worker side: prepare the jobs whose generation changed."""
+        for job in self.jobs:
+            apply, generation, prepare, last, pending = job
+            if pending is not None:
+                continue  # previous result not applied yet
+            try:
+                current = generation()
+                if current == last:
+                    self.skipped += 1
+                    continue
+                result = prepare() if prepare is not None else None
+                with self.lock:
+                    job[3] = current
+                    job[4] = (result,)
+            except Exception as e:
+                self._failed(e)
+
+    def flush(self):
+        """Render side: hand prepared results to DearPyGui."""
+        try:
+            if self.sync is not None:
+                self.sync()
+        except Exception as e:
+            self._failed(e)
+        for job in self.jobs:
+            with self.lock:
+                pending, job[4] = job[4], None
+            if pending is None:
+                continue
+            try:
+                if job[2] is not None:
+                    job[0](pending[0])
+                else:
+                    job[0]()
+                self.updates += 1
+            except Exception as e:
+                self._failed(e)
+
+    def _failed(self, e):
+        # Log once per distinct error, not at the refresh rate
+        if str(e) != self.last_error:
+            self.last_error = str(e)
+            log.error(f"[Plot] Update failed: {e}")
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while self.running:
+            self.tick()
+            next_tick += 1.0 / self.rate_hz
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Running behind (slow machine): skip ahead instead of bursting
+                next_tick = time.monotonic()
@@ -1,6 +1,10 @@
 
 import dearpygui.dearpygui as dpg
 from stream_handler import StreamHandler
+from stream_export import ExportJob
+from decimate import DECIMATION_METHODS
+from gui.plot_scheduler import PlotScheduler
+import numpy as np
 import time
 
 STREAM_PANEL_TAG = "stream_panel"
@@ -13,8 +17,13 @@ STREAM_STATUS_TAG = "stream_status_text"
 STREAM_MODE_SELECTOR_TAG = "stream_mode_selector"
 STREAM_SAVE_BUTTON_TAG = "stream_save_button"
 STREAM_SAVE_PATH_TAG = "stream_save_path"
+STREAM_EXPORT_PROGRESS_TAG = "stream_export_progress"
+STREAM_EXPORT_CANCEL_TAG = "stream_export_cancel"
+STREAM_DECIMATION_TAG = "stream_decimation_selector"
+STREAM_REFRESH_RATE_TAG = "stream_refresh_rate"
 
 PLOT_WINDOW_SECONDS = 5.0
+PLOT_REFRESH_HZ = 30
 
 class StreamPanel:
     def __init__(self, controller):
@@ -27,6 +36,28 @@ class StreamPanel:
         self.handler = StreamHandler(controller, sample_rate=sample_rate)
         self.plot_mode = "scrolling"
         self.last_update_time = 0
+        self.export_job = None
+        self.plot_buffers = None
+        self.view = None  # (mode, method, width) as of the last frame
+        self.scheduler = PlotScheduler(PLOT_REFRESH_HZ, sync=self.sync_view)
+        self.scheduler.add(self.apply_plot, self.plot_generation, self.prepare_plot)
+        self.scheduler.add(self.update_export, self.export_generation)
+
+    def sync_view(self):
+        # Render thread: snapshot the view settings for the scheduler thread
+        self.view = (dpg.get_value(STREAM_MODE_SELECTOR_TAG),
+                     dpg.get_value(STREAM_DECIMATION_TAG),
+                     max(100, int(dpg.get_item_rect_size(STREAM_PLOT_DUTY_TAG)[0] or 400)))
+
+    def plot_generation(self):
+        # Redraw only when new samples arrived or the view settings changed
+        return (self.handler.sample_count, self.view)
+
+    def export_generation(self):
+        job = self.export_job
+        if job is None:
+            return None
+        return (id(job), job.progress, job.done)
 
     def toggle_stream(self):
         if self.handler.streaming:
@@ -38,48 +69,75 @@ class StreamPanel:
             dpg.configure_item(STREAM_BUTTON_TAG, label="Stop Streaming")
             dpg.set_value(STREAM_STATUS_TAG, "Streaming started.")
 
-    def update_plot(self):
-        now = self.handler.get_last_timestamp()
-        if now is None:
-            return
-
-        viewport_width = dpg.get_item_rect_size(STREAM_PLOT_DUTY_TAG)[0] or 400
-        max_points = max(100, int(viewport_width))
+    def get_plot_buffers(self, width):
+        # Float64 output buffers reused every redraw: ((t, duty), (t, current))
+        size = 2 * width + 16
+        if self.plot_buffers is None or len(self.plot_buffers[0][0]) < size:
+            self.plot_buffers = tuple((np.empty(size), np.empty(size)) for _ in range(2))
+        return self.plot_buffers
 
-        mode = dpg.get_value(STREAM_MODE_SELECTOR_TAG)
+    def prepare_plot(self):
+        # Scheduler thread: decimate into the reused buffers, no DearPyGui calls
+        now = self.handler.get_last_timestamp()
+        if now is None or self.view is None:
+            return None
 
-        if mode == "scrolling":
-            t0 = max(0, now - PLOT_WINDOW_SECONDS)
-            ts, duty, curr = self.handler.get_samples_by_time(t0, now)
-            ts, duty, curr = self._downsample(ts, duty, curr, max_points)
-        elif mode == "resizing":
-            ts, duty, curr = self.handler.get_samples_by_time(0, now)
-            ts, duty, curr = self._downsample(ts, duty, curr, max_points)
-        elif mode == "wrap":
-            t0 = max(0, now - PLOT_WINDOW_SECONDS)
-            ts, duty, curr = self.handler.get_samples_by_time(t0, now)
-            ts = [(t % PLOT_WINDOW_SECONDS) for t in ts]
-            ts, duty, curr = self._downsample(ts, duty, curr, max_points)
+        mode, method, width = self.view
+        if mode == "Resizing":
+            t0 = 0
         else:
-            ts, duty, curr = [], [], []
-
-        dpg.set_value(STREAM_LINE_DUTY_TAG, [ts, duty])
-        dpg.set_value(STREAM_LINE_CURR_TAG, [ts, curr])
+            t0 = max(0, now - PLOT_WINDOW_SECONDS)
+        (ts_d, duty), (ts_c, curr) = self.handler.get_decimated(
+            t0, now, width, method, out=self.get_plot_buffers(width))
+        if mode == "Wrap":
+            np.mod(ts_d, PLOT_WINDOW_SECONDS, out=ts_d)
+            np.mod(ts_c, PLOT_WINDOW_SECONDS, out=ts_c)
+        return (ts_d, duty), (ts_c, curr)
 
-    def _downsample(self, ts, ys1, ys2, max_points):
-        stride = max(1, len(ts) // max_points)
-        return ts[::stride], ys1[::stride], ys2[::stride]
+    def apply_plot(self, series):
+        if series is None:
+            return
+        (ts_d, duty), (ts_c, curr) = series
+        # Contiguous float64 arrays go to DearPyGui through the buffer
+        # protocol, without building Python float lists every redraw
+        dpg.set_value(STREAM_LINE_DUTY_TAG, [ts_d, duty])
+        dpg.set_value(STREAM_LINE_CURR_TAG, [ts_c, curr])
 
     def save_to_csv(self):
+        """Export the recording in the background (.csv, .npz or .parquet by extension)."""
         path = dpg.get_value(STREAM_SAVE_PATH_TAG)
         if not path:
             dpg.set_value(STREAM_STATUS_TAG, "Please specify a file path.")
             return
-        try:
-            self.handler.export_csv(path)
-            dpg.set_value(STREAM_STATUS_TAG, f"Exported to {path}")
-        except Exception as e:
-            dpg.set_value(STREAM_STATUS_TAG, f"Export failed: {e}")
+        if self.export_job and not self.export_job.done:
+            dpg.set_value(STREAM_STATUS_TAG, "Export already running.")
+            return
+        self.export_job = ExportJob(self.handler.segment_files, path).start()
+        dpg.set_value(STREAM_STATUS_TAG, f"Exporting to {path}...")
+        dpg.configure_item(STREAM_EXPORT_PROGRESS_TAG, show=True)
+        dpg.configure_item(STREAM_EXPORT_CANCEL_TAG, show=True)
+
+    def cancel_export(self):
+        if self.export_job:
+            self.export_job.cancel()
+
+    def update_export(self):
+        job = self.export_job
+        if job is None:
+            return
+        dpg.set_value(STREAM_EXPORT_PROGRESS_TAG, job.progress)
+        dpg.configure_item(STREAM_EXPORT_PROGRESS_TAG, overlay=f"{job.progress * 100:.0f}%")
+        if not job.done:
+            return
+        if job.cancelled:
+            dpg.set_value(STREAM_STATUS_TAG, "Export cancelled.")
+        elif job.error:
+            dpg.set_value(STREAM_STATUS_TAG, f"Export failed: {job.error}")
+        else:
+            dpg.set_value(STREAM_STATUS_TAG, f"Exported {job.samples} samples to {job.dst}")
+        dpg.configure_item(STREAM_EXPORT_PROGRESS_TAG, show=False)
+        dpg.configure_item(STREAM_EXPORT_CANCEL_TAG, show=False)
+        self.export_job = None
 
 def create_stream_panel(controller):
     panel = StreamPanel(controller)
@@ -89,9 +147,17 @@ def create_stream_panel(controller):
             dpg.add_spacer(width=30)
             dpg.add_combo(["Scrolling", "Resizing", "Wrap"], default_value="Scrolling", tag=STREAM_MODE_SELECTOR_TAG, label="View Mode", width=150)
             dpg.add_spacer(width=30)
-            dpg.add_input_text(label="CSV Save Path", tag=STREAM_SAVE_PATH_TAG, default_value="stream_export.csv", width=200)
+            dpg.add_combo(list(DECIMATION_METHODS), default_value="minmax", tag=STREAM_DECIMATION_TAG, label="Decimation", width=100)
             dpg.add_spacer(width=30)
-            dpg.add_button(label="Save to CSV", tag=STREAM_SAVE_BUTTON_TAG, callback=lambda: panel.save_to_csv())
+            dpg.add_input_int(label="Refresh (Hz)", tag=STREAM_REFRESH_RATE_TAG, default_value=PLOT_REFRESH_HZ,
+                              min_value=1, max_value=120, min_clamped=True, max_clamped=True, width=90,
+                              callback=lambda s, a: panel.scheduler.set_rate(a))
+            dpg.add_spacer(width=30)
+            dpg.add_input_text(label="Save Path (.csv/.npz/.parquet)", tag=STREAM_SAVE_PATH_TAG, default_value="stream_export.csv", width=200)
+            dpg.add_spacer(width=30)
+            dpg.add_button(label="Save", tag=STREAM_SAVE_BUTTON_TAG, callback=lambda: panel.save_to_csv())
+            dpg.add_progress_bar(default_value=0.0, width=120, tag=STREAM_EXPORT_PROGRESS_TAG, show=False)
+            dpg.add_button(label="Cancel", tag=STREAM_EXPORT_CANCEL_TAG, show=False, callback=lambda: panel.cancel_export())
             dpg.add_text("", tag=STREAM_STATUS_TAG)
         with dpg.plot(label="PWM Duty", height=200, width=-1, tag=STREAM_PLOT_DUTY_TAG):
             dpg.add_plot_axis(dpg.mvXAxis, label="Time (s)")
@@ -102,11 +168,7 @@ def create_stream_panel(controller):
             with dpg.plot_axis(dpg.mvYAxis, label="Current"):
                 dpg.add_line_series([], [], tag=STREAM_LINE_CURR_TAG, label="Current")
 
-    def periodic_update():
-        panel.update_plot()
-        dpg.set_frame_callback(dpg.get_frame_count() + 1, periodic_update)
-
-    dpg.set_frame_callback(dpg.get_frame_count() + 1, periodic_update)
+    panel.scheduler.start()
     return panel
 
 
@@ -4,6 +4,8 @@ import time
 import numpy as np
 import threading
 from recorder import record_audio
+from trajectory import compile_test_steps, TrajectoryPlayer, supports_hardware_sequences, tick_us_for_rate
+from gui.logger import log
 import csv
 import platform
 
@@ -38,10 +40,30 @@ def show_no_device_popup():
 def is_controller_ready(controller):
     return controller and hasattr(controller, 'ser') and controller.ser and controller.ser.is_open
 
+def get_sequence_tick(controller):
+    """ISR tick (us) if the firmware can play compiled sequences, else None."""
+    try:
+        status = controller.get_status()
+    except Exception:
+        return None
+    if not supports_hardware_sequences(status):
+        return None
+    return tick_us_for_rate(status["current_adc_rate"])
+
+def play_sequence(controller, sequence, on_step=None):
+    """Play a compiled sequence on the device; the host only tops up the queue and tracks progress."""
+    player = TrajectoryPlayer(controller, sequence)
+    completed = player.run(should_stop=lambda: not routine_running, on_step=on_step,
+                           progress=lambda f: dpg.set_value("test_progress", f))
+    if not completed:
+        controller.send_duty(0)
+    return completed
+
 def on_stop(sender, app_data, controller):
     global routine_running
     routine_running = False
     if is_controller_ready(controller):
+        controller.stop_automation()
         controller.stop_pwm()
         controller.send_duty(0)
         dpg.set_value("test_progress", 0.0)
@@ -143,9 +165,19 @@ def run_test_routine(controller):
     release_freq_steps = np.linspace(release_freq_A, release_freq_B, steps)
     power_index_steps = np.linspace(power_index_A, power_index_B, steps)
 
-    # Check if all ramp times are zero
-    if np.allclose(ramp_times, 0):
-        # --- Software routine ---
+    tick_us = get_sequence_tick(controller)
+    if tick_us is not None:
+        # --- Hardware-timed routine: the whole sequence plays from the device queue ---
+        release = None
+        if soft_release_enabled:
+            release = (np.round(release_points_steps), np.round(release_freq_steps), np.round(power_index_steps))
+        sequence = compile_test_steps(tick_us, start_duties, start_times, ramp_times,
+                                      end_duties, end_times, release=release)
+        play_sequence(controller, sequence)
+    else:
+        # --- Software routine (firmware before 2.3 cannot play queued sequences) ---
+        if not np.allclose(ramp_times, 0):
+            log.error("[Test] Ramps need firmware 2.3; running the steps without ramps")
         for i in range(steps):
             if not routine_running:
                 controller.send_duty(0)
@@ -177,25 +209,6 @@ def run_test_routine(controller):
                 if release_freq_steps[i] > 0:
                     time.sleep(release_points_steps[i] / release_freq_steps[i])
         controller.send_duty(0) 
-    else:
-        # --- Hardware trajectory routine ---
-        for i in range(steps):
-            if not routine_running:
-                break
-            controller.queue_traj_segment(start_duties[i], end_duties[i], ramp_times[i], shape=1)
-            dpg.set_value("test_progress", (i + 1.0) / steps)
-            # --- Soft release after each step ---
-            if soft_release_enabled:
-                controller.send_soft_release(
-                    end_duties[i],
-                    int(round(release_points_steps[i])),
-                    int(round(release_freq_steps[i])),
-                    int(round(power_index_steps[i]))
-                )
-                if release_freq_steps[i] > 0:
-                    time.sleep(release_points_steps[i] / release_freq_steps[i])
-        # Start automation
-        controller.start_automation()
     dpg.set_value("test_progress", 0)
     routine_running = False
 
@@ -299,8 +312,11 @@ def run_test_routine_recorded(controller):
             meta_file.write(f"Platform: {platform.platform()}\n")
             meta_file.write(f"Note: {note}\n")
 
-    if np.allclose(ramp_times, 0):
-        # --- Software routine with per-step recording ---
+    tick_us = get_sequence_tick(controller)
+    if tick_us is None:
+        # --- Software routine with per-step recording (firmware before 2.3) ---
+        if not np.allclose(ramp_times, 0):
+            log.error("[Test] Ramps need firmware 2.3; running the steps without ramps")
         for i in range(steps):
             velocity = round(end_duties[i], 2)
             take = str(i+1)
@@ -376,14 +392,20 @@ def run_test_routine_recorded(controller):
             time.sleep(post_roll)
         controller.send_duty(0)
     else:
-        # --- Hardware trajectory routine with per-step recording ---
-        for i in range(steps):
+        # --- Hardware-timed routine with per-step recording ---
+        release = None
+        if soft_release_enabled:
+            release = (np.round(release_points_steps), np.round(release_freq_steps), np.round(power_index_steps))
+        sequence = compile_test_steps(tick_us, start_duties, start_times, ramp_times, end_duties, end_times,
+                                      release=release, pre_roll=pre_roll, post_roll=post_roll)
+
+        def on_step(i):
+            # Recording stays host-timed; it starts as the step's pre-roll begins on the device
             velocity = round(end_duties[i], 2)
             take = str(i+1)
             filename = template.format(date=date_str, time=time_str, note=note, velocity=velocity, take=take)
             filepath = os.path.join(folder, filename)
             os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            # Calculate release duration if needed
             if soft_release_enabled:
                 rel_points = int(round(release_points_steps[i]))
                 rel_freq = int(round(release_freq_steps[i]))
@@ -398,17 +420,11 @@ def run_test_routine_recorded(controller):
             if include_release:
                 duration += release_duration
             duration += post_roll
-            audio_thread = threading.Thread(
+            threading.Thread(
                 target=record_audio,
                 args=(filepath, duration, sample_rate, channels, device, bit_depth),
                 daemon=True
-            )
-            audio_thread.start()
-            time.sleep(pre_roll)
-            if not routine_running:
-                break
-            controller.queue_traj_segment(start_duties[i], end_duties[i], ramp_times[i], shape=1)
-            dpg.set_value("test_progress", (i + 1.0) / steps)
+            ).start()
             if csv_writer:
                 csv_writer.writerow([
                     i+1,
@@ -421,18 +437,8 @@ def run_test_routine_recorded(controller):
                     rel_freq,
                     rel_power
                 ])
-            # --- Soft release after each step ---
-            if soft_release_enabled:
-                controller.send_soft_release(
-                    end_duties[i],
-                    rel_points,
-                    rel_freq,
-                    rel_power
-                )
-                if rel_freq > 0:
-                    time.sleep(rel_points / rel_freq)
-            time.sleep(post_roll)
-        controller.start_automation()
+
+        play_sequence(controller, sequence, on_step=on_step)
     if csv_file:
         csv_file.close()
     dpg.set_value("test_progress", 0)
@@ -5,6 +5,7 @@ from gui.themes import (load_custom_font, apply_global_theme)
 from gui.device_panel import create_serial_port_panel
 from gui.control_panel import create_control_panel
 from gui.logger import log
+from gui.plot_scheduler import flush_schedulers, stop_schedulers
 from gui.test_panel import create_test_panel
 from gui.sound_panel import create_sound_panel
 
@@ -22,7 +23,7 @@ def sync_menu_with_panel_visibility():
         is_visible = dpg.is_item_shown(tag)
         dpg.set_value(menu_item_tag, is_visible)
 
-def setup_gui(controller):
+def setup_gui(controller, manager=None):
     dpg.create_context()
     dpg.configure_app(docking=True, docking_space=True)
 
@@ -60,7 +61,7 @@ def setup_gui(controller):
 
     # Dockable panels
     with dpg.window(label="Controller", tag="serial_panel", width=300, height=100, pos=(10, 50), on_close=handle_window_closed, user_data="serial_panel"):
-        create_serial_port_panel(controller)
+        create_serial_port_panel(controller, manager)
     with dpg.window(label="Control Panel", tag="control_panel", width=300, height=200, pos=(10, 160), on_close=handle_window_closed, user_data="control_panel"):
         create_control_panel(controller)
     with dpg.window(label="Log Output", tag="log_panel", width=720, height=120, pos=(10, 370), on_close=handle_window_closed, user_data="log_panel"):
@@ -82,4 +83,13 @@ def setup_gui(controller):
     dpg.show_viewport()
     dpg.maximize_viewport()
 
-    dpg.start_dearpygui()
+    # Render loop instead of start_dearpygui() so queued log lines and
+    # prepared plot updates are pushed to their widgets once per frame
+    while dpg.is_dearpygui_running():
+        log.flush()
+        flush_schedulers()
+        dpg.render_dearpygui_frame()
+
+    # No worker may touch DearPyGui once the context is gone
+    stop_schedulers()
+    dpg.destroy_context()
@@ -1,7 +1,9 @@
 from teensy_controller import TeensySolenoidController
+from device_manager import DeviceManager
 from gui.viewport import setup_gui
 
 controller = TeensySolenoidController()
+manager = DeviceManager(controller)
 
 if __name__ == "__main__":
-    setup_gui(controller)
+    setup_gui(controller, manager)
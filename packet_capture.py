@@ -0,0 +1,211 @@
+# === packet_capture.py ===
+# Raw serial traffic capture and replay.
+#
+# Capture file layout:
+#   CAPTURE_HEADER  magic b"CAPT", version, capture start as epoch seconds
+#   records:        CAPTURE_RECORD (nanoseconds since start on the monotonic
+#                   clock, direction, length) followed by the bytes exactly
+#                   as they were written to or read from the port
+#
+# Replay a capture through the decoders at full speed:
+#
+#   python packet_capture.py capture.cap --repeat 10
+import os
+import queue
+import struct
+import threading
+import time
+
+from stream_decoder import StreamDecoder
+
+CAPTURE_MAGIC = b"CAPT"
+CAPTURE_HEADER = struct.Struct("<4sHd")
+CAPTURE_RECORD = struct.Struct("<QBI")
+TX = 0
+RX = 1
+
+
+class PacketCapture:
+    """
+    Appends raw TX/RX chunks to a capture file. record() only stamps the
+    chunk and queues it, so the serial threads never wait on the disk; a
+    background thread packs whatever is queued into one write. If the disk
+    cannot keep up, chunks are dropped and counted.
+    """
+
+    def __init__(self, filename, queue_size=4096, flush_bytes=1 << 16):
+        self.filename = filename
+        self.flush_bytes = flush_bytes
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.t0 = time.monotonic_ns()
+        self.records = 0
+        self.bytes_written = 0
+        self.dropped = 0
+        self.error = None
+        self.file = open(filename, "wb")
+        self.file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, 1, time.time()))
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def record(self, direction, data):
+        if not data:
+            return
+        try:
+            self.queue.put_nowait((time.monotonic_ns() - self.t0, direction, bytes(data)))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.file.close()
+
+    def _run(self):
+        buf = bytearray()
+        done = False
+        while not done:
+            item = self.queue.get()
+            while True:
+                if item is None:
+                    done = True
+                    break
+                t, direction, data = item
+                buf += CAPTURE_RECORD.pack(t, direction, len(data))
+                buf += data
+                self.records += 1
+                if len(buf) >= self.flush_bytes:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if buf and self.error is None:
+                try:
+                    self.file.write(buf)
+                    self.file.flush()
+                    self.bytes_written += len(buf)
+                except OSError as e:
+                    self.error = e
+            buf.clear()
+
+
+class CaptureTransport:
+    """
+    Wraps a pyserial-like port so every read and write is also recorded to
+    a PacketCapture. Everything else is passed through to the port.
+    """
+
+    def __init__(self, ser, capture):
+        object.__setattr__(self, "ser", ser)
+        object.__setattr__(self, "capture", capture)
+
+    def write(self, data):
+        self.capture.record(TX, data)
+        return self.ser.write(data)
+
+    def read(self, size=1):
+        data = self.ser.read(size)
+        self.capture.record(RX, data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.ser, name, value)
+
+
+def read_capture(filename):
+    """
+    Header dict (version, start_time) and a generator of
+    (seconds since start, direction, data) records. A record cut short at
+    the end of the file (capture still open or killed) is ignored.
+    """
+    f = open(filename, "rb")
+    raw = f.read(CAPTURE_HEADER.size)
+    if len(raw) < CAPTURE_HEADER.size or raw[:4] != CAPTURE_MAGIC:
+        f.close()
+        raise ValueError("Not a capture file")
+    _, version, start_time = CAPTURE_HEADER.unpack(raw)
+    if version != 1:
+        f.close()
+        raise ValueError(f"Unsupported capture version {version}")
+
+    def records():
+        with f:
+            while True:
+                raw = f.read(CAPTURE_RECORD.size)
+                if len(raw) < CAPTURE_RECORD.size:
+                    return
+                t, direction, length = CAPTURE_RECORD.unpack(raw)
+                data = f.read(length)
+                if len(data) < length:
+                    return
+                yield t * 1e-9, direction, data
+
+    return {"version": version, "start_time": start_time}, records()
+
+
+def replay(filename, repeat=1):
+    """
+    Feed the RX side of a capture through the same decoder the
+    SerialReader uses, as fast as it will go, and the TX side through a
+    command decoder. The capture is loaded into memory first so only
+    decoding is timed. Returns throughput statistics.
+    """
+    _, records = read_capture(filename)
+    records = list(records)
+    rx = [data for _, direction, data in records if direction == RX]
+    tx = [data for _, direction, data in records if direction == TX]
+    span = records[-1][0] - records[0][0] if records else 0.0
+
+    stats = {"rx_chunks": len(rx) * repeat, "rx_bytes": sum(map(len, rx)) * repeat,
+             "tx_bytes": sum(map(len, tx)) * repeat, "samples": 0, "time_syncs": 0,
+             "rx_commands": 0, "tx_commands": 0, "crc_errors": 0, "skipped_bytes": 0}
+    rx_decoder = StreamDecoder(parse_commands=True)
+    tx_decoder = StreamDecoder(parse_commands=True, command_lengths=None)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        rx_decoder.reset()
+        tx_decoder.reset()
+        for data in rx:
+            batch = rx_decoder.feed(data)
+            stats["samples"] += len(batch["duty"])
+            stats["time_syncs"] += len(batch["time"])
+            stats["rx_commands"] += len(batch["commands"])
+        for data in tx:
+            stats["tx_commands"] += len(tx_decoder.feed(data)["commands"])
+        # reset() clears the decoder's counters, so add up every pass
+        stats["crc_errors"] += rx_decoder.crc_errors
+        stats["skipped_bytes"] += rx_decoder.skipped_bytes
+    elapsed = time.perf_counter() - t0
+
+    stats["elapsed_s"] = elapsed
+    stats["capture_s"] = span * repeat
+    stats["mb_per_s"] = stats["rx_bytes"] / elapsed / 1e6 if elapsed > 0 else float("inf")
+    stats["speedup"] = stats["capture_s"] / elapsed if elapsed > 0 else float("inf")
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay serial captures through the stream/command decoders")
+    parser.add_argument("files", nargs="+", help=".cap files written by PacketCapture")
+    parser.add_argument("--repeat", type=int, default=1, help="decode each capture this many times")
+    args = parser.parse_args()
+
+    for path in args.files:
+        try:
+            s = replay(path, repeat=args.repeat)
+        except (OSError, ValueError) as e:
+            print(f"{path}: {e}")
+            continue
+        print(f"{os.path.basename(path)}: {s['rx_bytes']} RX bytes in {s['rx_chunks']} chunks, "
+              f"{s['samples']} samples, {s['time_syncs']} syncs, "
+              f"{s['rx_commands']} responses, {s['tx_commands']} commands, {s['crc_errors']} CRC errors")
+        print(f"    {s['elapsed_s'] * 1000:.1f} ms, {s['mb_per_s']:.1f} MB/s, "
+              f"{s['speedup']:.0f}x real time")
@@ -0,0 +1,111 @@
+# === ring_buffer.py ===
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Preallocated, typed ring buffer with one NumPy array per column:
+
+        ring = RingBuffer(100000, duty=np.uint16, current=np.uint16, time=np.float64)
+        ring.extend(duty=d, current=c, time=t)
+
+    extend() does at most two slice copies per column. Readers get views
+    into the storage (valid until the writer overwrites them), so callers
+    hold the owner's lock while using them or copy what they keep.
+    """
+
+    def __init__(self, capacity, **columns):
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in columns.items()}
+        self.write_index = 0
+        self.count = 0  # total samples ever written
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for col in self.columns.values())
+
+    def clear(self):
+        self.write_index = 0
+        self.count = 0
+
+    def extend(self, **values):
+        """Append one batch; every column must be given with the same length."""
+        arrays = {name: np.asarray(values[name]) for name in self.columns}
+        n = len(next(iter(arrays.values())))
+        if n == 0:
+            return
+        self.count += n
+        if n >= self.capacity:
+            # Only the newest `capacity` samples survive
+            for name, col in self.columns.items():
+                col[:] = arrays[name][n - self.capacity:]
+            self.write_index = 0
+            return
+
+        start = self.write_index
+        first = min(n, self.capacity - start)
+        for name, col in self.columns.items():
+            src = arrays[name]
+            col[start:start + first] = src[:first]
+            if first < n:
+                col[:n - first] = src[first:]
+        self.write_index = (start + n) % self.capacity
+
+    def segments(self):
+        """Index ranges of the stored samples, oldest first (one or two)."""
+        if self.count < self.capacity:
+            return [(0, self.count)] if self.count else []
+        if self.write_index == 0:
+            return [(0, self.capacity)]
+        return [(self.write_index, self.capacity), (0, self.write_index)]
+
+    def views(self, name):
+        col = self.columns[name]
+        return [col[a:b] for a, b in self.segments()]
+
+    def ordered(self, name, start=0, stop=None):
+        """
+        Column in chronological order, sliced by logical position
+        (0 = oldest stored sample). A view when the range does not cross
+        the wrap point, otherwise a copy.
+        """
+        size = len(self)
+        stop = size if stop is None else min(stop, size)
+        start = max(0, start)
+        col = self.columns[name]
+        if start >= stop:
+            return col[:0]
+        base = self.write_index if self.count >= self.capacity else 0
+        a = (base + start) % self.capacity
+        b = a + (stop - start)
+        if b <= self.capacity:
+            return col[a:b]
+        return np.concatenate((col[a:], col[:b - self.capacity]))
+
+    def searchsorted(self, name, value, side="left"):
+        """
+        Logical position of value in a column that increases monotonically
+        in write order (e.g. timestamps), by binary search over the one or
+        two stored segments.
+        """
+        offset = 0
+        for seg in self.views(name):
+            if len(seg) and (value < seg[-1] or (side == "left" and value == seg[-1])):
+                return offset + int(np.searchsorted(seg, value, side=side))
+            offset += len(seg)
+        return offset
+
+    def latest(self, n):
+        """Dict of the newest n samples per column."""
+        size = len(self)
+        return {name: self.ordered(name, size - min(n, size)) for name in self.columns}
+
+    def last(self, name):
+        if self.count == 0:
+            return None
+        return self.columns[name][(self.write_index - 1) % self.capacity]
@@ -0,0 +1,208 @@
+# === serial_reader.py ===
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from stream_decoder import StreamDecoder, merge_batches
+from gui.logger import log
+
+CMD_ACK = 0x7F
+CMD_ERROR = 0xFE
+
+ERROR_CODES = {
+    0xE1: "invalid payload",
+    0xE2: "invalid duty",
+    0xE3: "unknown command",
+    0xE4: "trajectory queue full",
+}
+# A command sent without awaiting a response is assumed to have succeeded
+# once this long has passed without an error (the firmware answers in
+# well under a millisecond)
+UNANSWERED_TIMEOUT = 0.1
+
+
+class SerialReader:
+    """
+    Background reader that owns the receive side of the serial port.
+
+    Every byte is parsed once, by a single StreamDecoder that understands
+    both the length/checksum command framing and the 0xA5/0xAA stream
+    framing. Responses are routed to per-command futures registered with
+    expect(); stream batches go to stream_queue.
+    """
+
+    def __init__(self, ser, stream_queue_size=1000):
+        self.ser = ser
+        self.decoder = StreamDecoder(parse_commands=True)
+        self.stream_queue = queue.Queue(maxsize=stream_queue_size)
+        self.dropped_batches = 0
+        self.lock = threading.Lock()
+        self.pending = {}          # response key -> deque of futures
+        # Futures and (cmd_id, sent at) of commands sent without one, in
+        # send order, to charge device errors to the right command
+        self.pending_order = deque()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.decoder.reset()
+        self.running = True
+        self.thread = threading.Thread(target=self._read_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2.0)
+        self.thread = None
+        self._fail_pending(Exception("[Serial] Reader stopped"))
+
+    def _fail_pending(self, exc):
+        with self.lock:
+            futures = [f for f in self.pending_order if isinstance(f, Future)]
+            self.pending.clear()
+            self.pending_order.clear()
+        for fut in futures:
+            if not fut.done():
+                fut.set_exception(exc)
+
+    def expect(self, key):
+        """
+        Register interest in the next response for `key` (the echoed command
+        of an ACK, or the command id of a reply such as GET_STATUS).
+        Must be called before the command is written.
+        """
+        fut = Future()
+        with self.lock:
+            self.pending.setdefault(key, deque()).append(fut)
+            self.pending_order.append(fut)
+        return fut
+
+    def note_unanswered(self, cmd_id):
+        """
+        Record a command written without expect(): it has no response to
+        wait for, but the device may still reject it with an error.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._expire_unanswered(now)
+            self.pending_order.append((cmd_id, now))
+
+    def _expire_unanswered(self, now):
+        order = self.pending_order
+        while order and isinstance(order[0], tuple) and now - order[0][1] > UNANSWERED_TIMEOUT:
+            order.popleft()
+
+    def cancel(self, fut):
+        with self.lock:
+            self._forget(fut)
+
+    def reset_stream(self):
+        """Drop any queued stream batches."""
+        while True:
+            try:
+                self.stream_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def get_stream_batch(self, timeout=1.0):
+        """
+        Wait for stream data and return everything queued so far merged into
+        one batch, or None on timeout.
+        """
+        try:
+            batches = [self.stream_queue.get(timeout=timeout)]
+        except queue.Empty:
+            return None
+        while True:
+            try:
+                batches.append(self.stream_queue.get_nowait())
+            except queue.Empty:
+                break
+        return merge_batches(batches)
+
+    def _forget(self, fut):
+        for waiters in self.pending.values():
+            if fut in waiters:
+                waiters.remove(fut)
+                break
+        if fut in self.pending_order:
+            self.pending_order.remove(fut)
+
+    def _read_loop(self):
+        while self.running:
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except Exception as e:
+                log.error(f"[Serial] Reader stopped: {e}")
+                self.running = False
+                # Nobody will answer the outstanding requests now
+                self._fail_pending(Exception(f"[Serial] Reader stopped: {e}"))
+                break
+            if not data:
+                continue
+            batch = self.decoder.feed(data)
+            for cmd_id, payload in batch.pop("commands"):
+                self._route(cmd_id, payload)
+            if len(batch["duty"]) or batch["time"]:
+                self._queue_stream(batch)
+
+    def _queue_stream(self, batch):
+        try:
+            self.stream_queue.put_nowait(batch)
+        except queue.Full:
+            # Nobody is consuming; keep the newest data
+            try:
+                self.stream_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.dropped_batches += 1
+            self.stream_queue.put_nowait(batch)
+
+    def _route(self, cmd_id, payload):
+        if log.enabled("incoming"):
+            full = bytes([len(payload) + 1, cmd_id]) + payload
+            full += bytes([sum(full[1:]) & 0xFF])
+            log.incoming(lambda: full.hex(" ").upper())
+
+        with self.lock:
+            order = self.pending_order
+            if cmd_id == CMD_ERROR:
+                # The firmware does not echo the failing command, so the
+                # error belongs to the oldest command that can still fail,
+                # whether or not anyone is waiting for its response
+                self._expire_unanswered(time.monotonic())
+                fut = order.popleft() if order else None
+                if isinstance(fut, Future):
+                    self._forget(fut)
+            else:
+                key = payload[0] if cmd_id == CMD_ACK and payload else cmd_id
+                waiters = self.pending.get(key)
+                fut = waiters[0] if waiters else None
+                if fut is not None:
+                    # Commands are answered in order: those sent before
+                    # this one without a response got through
+                    while order and isinstance(order[0], tuple):
+                        order.popleft()
+                    self._forget(fut)
+
+        if cmd_id == CMD_ERROR:
+            code = payload[0] if payload else 0
+            reason = ERROR_CODES.get(code, "unknown error")
+            error = f"[Serial] Device error 0x{code:02X} ({reason})"
+            if isinstance(fut, Future):
+                fut.set_exception(Exception(error))
+            elif fut is not None:
+                log.error(f"{error} for cmd 0x{fut[0]:02X}")
+            else:
+                log.error(error)
+        elif fut is None:
+            log.debug(lambda: f"[Serial] Unsolicited packet: cmd=0x{cmd_id:02X}, payload={payload.hex()}")
+        else:
+            fut.set_result((cmd_id, payload))
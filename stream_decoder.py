@@ -0,0 +1,228 @@
+# === stream_decoder.py ===
+import time
+
+import numpy as np
+from crc8 import check_frames
+
+STREAM_PACKET_MAGIC = 0xA5
+STREAM_TIME_MAGIC = 0xAA
+STREAM_BUFFER_SIZE = 8
+
+# Data packet: [A5][flags][8 samples * 4][crc]
+DATA_PACKET_SIZE = 1 + 1 + 4 * STREAM_BUFFER_SIZE + 1
+# Time sync packet: [AA][type][4 bytes time][crc]
+TIME_PACKET_SIZE = 1 + 1 + 4 + 1
+# Command packet: [len][cmd][payload][checksum], len counts cmd + payload
+MAX_COMMAND_LENGTH = 62
+# Device responses that can be interleaved with the stream: id -> valid
+# length bytes. Only these are accepted, so stray bytes almost never pass
+# for a response on the 8-bit checksum alone.
+RESPONSE_LENGTHS = {
+    0x7F: (2, 8),   # ACK [echo], trajectory ACK [echo][queue state]
+    0xFE: (2,),     # ERROR [code]
+    0x02: (17,),    # GET_STATUS
+    0x53: (7,),     # GET_TRAJ_STATUS
+}
+
+
+class StreamDecoder:
+    """
+    Incremental decoder for the 0xA5 / 0xAA stream framing.
+    Bytes are fed in whatever chunks the serial port returns; complete
+    packets are decoded in bulk and any trailing partial packet is kept
+    for the next call.
+
+    With parse_commands=True the length/checksum command framing is
+    decoded as well, so one reader can demultiplex both. The magic bytes
+    are larger than any valid length byte, so the two never collide.
+    command_lengths restricts the frames accepted to known ids and
+    lengths (device responses by default); None accepts any frame, for
+    the host-to-device direction.
+    """
+
+    def __init__(self, parse_commands=False, command_lengths=RESPONSE_LENGTHS):
+        self.parse_commands = parse_commands
+        self.command_lengths = command_lengths
+        self.buffer = bytearray()
+        self.crc_errors = 0
+        self.skipped_bytes = 0
+
+    def reset(self):
+        self.buffer.clear()
+        self.crc_errors = 0
+        self.skipped_bytes = 0
+
+    def feed(self, data):
+        """
+        Append raw bytes and decode every complete packet.
+        Returns a dict with:
+            duty, current: uint16 arrays, 8 samples per valid data packet
+            flags: uint8 array, one entry per valid data packet
+            time: list of (type, micros, sample_index, received) tuples from
+                valid time sync packets; sample_index is the number of
+                samples in this batch that precede the sync, received the
+                host time.time() at which the bytes were fed
+            commands: list of (cmd_id, payload) tuples (parse_commands only)
+        """
+        received = time.time()
+        if data:
+            self.buffer += data
+        buf = self.buffer
+        n = len(buf)
+        raw = np.frombuffer(bytes(buf), dtype=np.uint8)
+
+        # Optimistic pass: take every complete frame at a magic byte and
+        # check the CRCs in bulk afterwards. If any fails, check every
+        # frame that could start at a magic byte and scan again, so a
+        # failed frame costs one byte of progress instead of a whole
+        # packet; a magic value in a payload or a dropped byte then never
+        # throws the scan out of sync
+        scan = self._scan(buf, n)
+        data = self._gather(raw, scan[0], DATA_PACKET_SIZE)
+        sync = self._gather(raw, scan[1], TIME_PACKET_SIZE)
+        if not (check_frames(data[0]).all() and check_frames(sync[0]).all()):
+            data_ok, data = self._candidates(raw, STREAM_PACKET_MAGIC, DATA_PACKET_SIZE)
+            time_ok, sync = self._candidates(raw, STREAM_TIME_MAGIC, TIME_PACKET_SIZE)
+            scan = self._scan(buf, n, data_ok, time_ok)
+        data_offsets, time_offsets, commands, skipped, crc_errors, pos = scan
+        self.skipped_bytes += skipped
+        self.crc_errors += crc_errors
+        del buf[:pos]
+
+        duty, current, flags = self._decode_data(data, data_offsets)
+        time_syncs = self._decode_time(sync, time_offsets, data_offsets, received)
+        return {"duty": duty, "current": current, "flags": flags, "time": time_syncs,
+                "commands": commands}
+
+    def _scan(self, buf, n, data_ok=None, time_ok=None):
+        """
+        Frame offsets up to the first incomplete packet. data_ok / time_ok
+        are indexed by offset and say whether the frame there passes its
+        CRC; without them every frame is taken. Returns (data offsets,
+        time offsets, commands, skipped bytes, CRC errors, end position).
+        """
+        lengths = self.command_lengths
+        data_offsets = []
+        time_offsets = []
+        commands = []
+        skipped = 0
+        crc_errors = 0
+        resync_end = 0  # no command frames inside a failed stream frame
+        pos = 0
+        while pos < n:
+            magic = buf[pos]
+            if magic == STREAM_PACKET_MAGIC:
+                if pos + DATA_PACKET_SIZE > n:
+                    break
+                if data_ok is None or data_ok[pos]:
+                    data_offsets.append(pos)
+                    pos += DATA_PACKET_SIZE
+                else:
+                    crc_errors += 1
+                    skipped += 1
+                    resync_end = max(resync_end, pos + DATA_PACKET_SIZE)
+                    pos += 1
+            elif magic == STREAM_TIME_MAGIC:
+                if pos + TIME_PACKET_SIZE > n:
+                    break
+                if time_ok is None or time_ok[pos]:
+                    time_offsets.append(pos)
+                    pos += TIME_PACKET_SIZE
+                else:
+                    crc_errors += 1
+                    skipped += 1
+                    resync_end = max(resync_end, pos + TIME_PACKET_SIZE)
+                    pos += 1
+            elif self.parse_commands and pos >= resync_end and 1 <= magic <= MAX_COMMAND_LENGTH:
+                if pos + 1 >= n:
+                    break
+                if lengths is not None and magic not in lengths.get(buf[pos + 1], ()):
+                    skipped += 1
+                    pos += 1
+                    continue
+                end = pos + 1 + magic + 1
+                if end > n:
+                    break
+                if sum(buf[pos + 1:end - 1]) & 0xFF == buf[end - 1]:
+                    commands.append((buf[pos + 1], bytes(buf[pos + 2:end - 1])))
+                    pos = end
+                else:
+                    skipped += 1
+                    pos += 1
+            elif self.parse_commands and pos >= resync_end:
+                skipped += 1
+                pos += 1
+            else:
+                # Resync on the next magic byte
+                next_data = buf.find(STREAM_PACKET_MAGIC, pos + 1)
+                next_time = buf.find(STREAM_TIME_MAGIC, pos + 1)
+                candidates = [i for i in (next_data, next_time) if i != -1]
+                next_pos = min(candidates) if candidates else n
+                if self.parse_commands:
+                    next_pos = min(next_pos, resync_end)
+                skipped += next_pos - pos
+                pos = next_pos
+        return data_offsets, time_offsets, commands, skipped, crc_errors, pos
+
+    @staticmethod
+    def _gather(raw, offsets, size):
+        offsets = np.asarray(offsets, dtype=np.intp)
+        return raw[offsets[:, None] + np.arange(size)], offsets
+
+    @staticmethod
+    def _candidates(raw, magic, size):
+        """
+        Frames starting at every `magic` byte with room for a whole frame.
+        Returns bytes indexed by offset (1 where the CRC matches) and the
+        gathered (frames, offsets).
+        """
+        offsets = np.flatnonzero(raw[:max(0, len(raw) - size + 1)] == magic)
+        frames = raw[offsets[:, None] + np.arange(size)]
+        ok = np.zeros(len(raw), dtype=np.uint8)
+        ok[offsets] = check_frames(frames)
+        return ok.tobytes(), (frames, offsets)
+
+    @staticmethod
+    def _rows(gathered, offsets):
+        frames, all_offsets = gathered
+        if len(offsets) == len(all_offsets):
+            return frames  # every gathered frame was taken
+        return frames[np.searchsorted(all_offsets, offsets)]
+
+    def _decode_data(self, gathered, offsets):
+        if not offsets:
+            empty = np.empty(0, dtype=np.uint16)
+            return empty, empty.copy(), np.empty(0, dtype=np.uint8)
+
+        frames = self._rows(gathered, offsets)
+        flags = frames[:, 1].copy()
+        samples = np.frombuffer(frames[:, 2:-1].tobytes(), dtype="<u2").reshape(-1, 2)
+        return samples[:, 0].copy(), samples[:, 1].copy(), flags
+
+    def _decode_time(self, gathered, offsets, data_offsets, received):
+        if not offsets:
+            return []
+
+        frames = self._rows(gathered, offsets)
+        micros = np.frombuffer(frames[:, 2:6].tobytes(), dtype=">u4")
+        # Position in the sample stream: valid data packets before the sync
+        sample_index = np.searchsorted(data_offsets, offsets) * STREAM_BUFFER_SIZE
+        return [(kind, us, index, received) for kind, us, index in
+                zip(frames[:, 1].tolist(), micros.tolist(), sample_index.tolist())]
+
+
+def merge_batches(batches):
+    """Concatenate decoded stream batches, keeping time sync sample indices consistent."""
+    if len(batches) == 1:
+        return batches[0]
+    time_syncs = []
+    base = 0
+    for b in batches:
+        time_syncs.extend((kind, us, base + index, received) for kind, us, index, received in b["time"])
+        base += len(b["duty"])
+    return {
+        "duty": np.concatenate([b["duty"] for b in batches]),
+        "current": np.concatenate([b["current"] for b in batches]),
+        "flags": np.concatenate([b["flags"] for b in batches]),
+        "time": time_syncs,
+    }
@@ -0,0 +1,223 @@
+# === stream_export.py ===
+import os
+import threading
+import zipfile
+
+import numpy as np
+
+from stream_file import StreamFile
+
+EXPORT_FORMATS = {".csv": "csv", ".npz": "npz", ".parquet": "parquet"}
+BLOCK_SAMPLES = 1 << 20
+CSV_DECIMALS = 9
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def _digit_table(width):
+    # ASCII digits of 0 .. 10**width - 1, zero padded
+    values = np.arange(10 ** width, dtype=np.uint32)
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.uint32)
+    return ((values[:, None] // powers) % 10 + ord("0")).astype(np.uint8)
+
+
+_TABLES = {}
+
+
+def _table(width):
+    if width not in _TABLES:
+        _TABLES[width] = _digit_table(width)
+    return _TABLES[width]
+
+
+def _digits(values, width):
+    """
+    ASCII digits of non-negative integers below 10**width as (chars, keep)
+    arrays of shape (n, width), looked up three digits at a time (five for
+    uint16 columns). keep masks off leading zeros.
+    """
+    if values.dtype == np.uint16 and width == 5:
+        chars = _table(5)[values]
+    else:
+        dtype = np.uint32 if width <= 9 else np.uint64
+        values = values.astype(dtype)
+        groups = -(-width // 3)
+        index = np.empty((len(values), groups), dtype=np.intp)
+        for g in range(groups):
+            index[:, groups - 1 - g] = (values // dtype(1000 ** g)) % dtype(1000)
+        chars = _table(3)[index].reshape(len(values), -1)[:, -width:]
+    thresholds = 10 ** np.arange(1, width, dtype=np.uint64)
+    ndigits = np.searchsorted(thresholds, values, side="right") + 1
+    keep = np.arange(width) >= (width - ndigits)[:, None]
+    return chars, keep
+
+
+def format_csv_block(t, duty, current, decimals=CSV_DECIMALS):
+    """
+    CSV text for one block of samples, built as a character matrix with
+    NumPy lookup tables instead of formatting row by row. Times are written
+    with up to `decimals` places (trailing zeros dropped).
+    """
+    n = len(t)
+    if n == 0:
+        return b""
+    scale = 10 ** decimals
+    scaled = np.round(np.abs(t) * scale).astype(np.uint64)
+    whole, frac = np.divmod(scaled, np.uint64(scale))
+
+    def column(char):
+        return np.full((n, 1), ord(char), dtype=np.uint8), np.ones((n, 1), dtype=bool)
+
+    sign = (column("-")[0], ((t < 0) & (scaled > 0))[:, None])
+    frac = frac.astype(np.uint32)
+    frac_chars = _digits(frac, decimals)[0]
+    # Drop trailing zeros of the fraction, keeping at least one digit
+    trailing = np.zeros(n, dtype=np.intp)
+    for k in range(1, decimals):
+        trailing += frac % np.uint32(10 ** k) == 0
+    frac_keep = np.arange(decimals) < (decimals - trailing)[:, None]
+    parts = [sign, _digits(whole, len(str(int(whole.max())))), column("."), (frac_chars, frac_keep),
+             column(","), _digits(duty, 5), column(","), _digits(current, 5), column("\n")]
+    chars = np.concatenate([p[0] for p in parts], axis=1)
+    keep = np.concatenate([p[1] for p in parts], axis=1)
+    return chars[keep].tobytes()
+
+
+def _blocks(files, block_samples, progress, cancel):
+    total = sum(len(sf) for sf in files)
+    done = 0
+    for sf in files:
+        for start in range(0, len(sf), block_samples):
+            if cancel is not None and cancel.is_set():
+                raise ExportCancelled()
+            block = sf[start:start + block_samples]
+            yield block
+            done += len(block[0])
+            if progress:
+                progress(done / total)
+
+
+def _export_csv(n, dst, blocks):
+    with open(dst, "wb") as out:
+        out.write(b"timestamp,duty,current\n")
+        for t, duty, current in blocks:
+            out.write(format_csv_block(t, duty, current))
+
+
+def _export_npz(n, dst, blocks):
+    # Streams each column into its own .npy member, so the whole recording
+    # never has to be in memory at once
+    columns = (("time", np.dtype("<f8")), ("duty", np.dtype("<u2")), ("current", np.dtype("<u2")))
+    tmp = {name: dst + f".{name}.tmp" for name, _ in columns}
+    handles = {name: open(path, "wb") for name, path in tmp.items()}
+    try:
+        for name, dtype in columns:
+            np.lib.format.write_array_header_1_0(
+                handles[name], {"descr": np.lib.format.dtype_to_descr(dtype),
+                                "fortran_order": False, "shape": (n,)})
+        for block in blocks:
+            for (name, dtype), values in zip(columns, block):
+                handles[name].write(np.asarray(values, dtype=dtype).tobytes())
+        for h in handles.values():
+            h.close()
+        with zipfile.ZipFile(dst, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for name, path in tmp.items():
+                zf.write(path, f"{name}.npy")
+    finally:
+        for h in handles.values():
+            h.close()
+        for path in tmp.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _export_parquet(n, dst, blocks):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("Parquet export needs pyarrow (pip install pyarrow)")
+    schema = pa.schema([("timestamp", pa.float64()), ("duty", pa.uint16()), ("current", pa.uint16())])
+    with pq.ParquetWriter(dst, schema) as writer:
+        for t, duty, current in blocks:
+            writer.write_table(pa.table([t, duty, current], schema=schema))
+
+
+EXPORTERS = {"csv": _export_csv, "npz": _export_npz, "parquet": _export_parquet}
+
+
+def export_recording(src, dst, fmt=None, progress=None, cancel=None, block_samples=BLOCK_SAMPLES):
+    """
+    Export a StreamHandler recording (v2 or v3 .bin, or a list of rotated
+    segments) to CSV, NPZ or Parquet, reading it in blocks of
+    block_samples. fmt defaults to the destination's extension.
+    progress(fraction) is called after every block; setting the cancel
+    Event stops the export, removes the partial output and raises
+    ExportCancelled. Returns the number of samples.
+    """
+    fmt = fmt or EXPORT_FORMATS.get(os.path.splitext(dst)[1].lower())
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unknown export format for {dst}")
+    sources = [src] if isinstance(src, str) else list(src)
+    if not sources:
+        raise ValueError("Nothing recorded to export")
+    files = []
+    try:
+        for path in sources:
+            files.append(StreamFile(path))
+        total = sum(len(sf) for sf in files)
+        try:
+            EXPORTERS[fmt](total, dst, _blocks(files, block_samples, progress, cancel))
+        except BaseException:
+            if os.path.exists(dst):
+                os.remove(dst)
+            raise
+    finally:
+        for sf in files:
+            sf.close()
+    if progress:
+        progress(1.0)
+    return total
+
+
+class ExportJob:
+    """
+    Runs export_recording on a worker thread. The GUI polls progress/done
+    from its frame callback and may call cancel().
+    """
+
+    def __init__(self, src, dst, fmt=None):
+        self.src = src
+        self.dst = dst
+        self.fmt = fmt
+        self.progress = 0.0
+        self.samples = None
+        self.error = None
+        self.cancelled = False
+        self.cancel_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    @property
+    def done(self):
+        return not self.thread.is_alive()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _set_progress(self, fraction):
+        self.progress = fraction
+
+    def _run(self):
+        try:
+            self.samples = export_recording(self.src, self.dst, self.fmt,
+                                            progress=self._set_progress, cancel=self.cancel_event)
+        except ExportCancelled:
+            self.cancelled = True
+        except Exception as e:
+            self.error = e
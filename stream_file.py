@@ -0,0 +1,146 @@
+# === stream_file.py ===
+import mmap
+
+import numpy as np
+
+from stream_format import (
+    CHUNK_HEADER, INDEX_DTYPE, RECORD_DTYPE, chunk_times, read_header, read_index,
+)
+
+V2_BLOCK_RECORDS = 65536
+
+
+class StreamFile:
+    """
+    Read-only, memory-mapped view of a StreamHandler recording (v2 or v3).
+
+    Opening a file only reads its header and chunk index, so even
+    multi-gigabyte captures open instantly; sample data is paged in by the
+    OS as it is touched. duty/current come back as zero-copy views into the
+    mapping (per chunk for v3, one structured record array for v2):
+
+        with StreamFile("stream_data/stream_20250101_120000.bin") as sf:
+            t, duty, current = sf.slice_time(10.0, 12.5)
+            for t, duty, current in sf.chunks():
+                ...
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        try:
+            header = read_header(self.file)
+            self.version = header["version"]
+            self.sample_rate = header["sample_rate"]
+            self.bit_depth = header["bit_depth"]
+            self.start_time = header.get("start_time")
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.version == 2:
+                count = (len(self.mm) - header["data_offset"]) // RECORD_DTYPE.itemsize
+                self.records = np.frombuffer(self.mm, dtype=RECORD_DTYPE, count=count,
+                                             offset=header["data_offset"])
+                starts = np.arange(0, count, V2_BLOCK_RECORDS)
+                self.index = np.zeros(len(starts), dtype=INDEX_DTYPE)
+                self.index["offset"] = header["data_offset"] + starts * RECORD_DTYPE.itemsize
+                self.index["start_tick"] = starts
+                self.index["count"] = np.minimum(V2_BLOCK_RECORDS, count - starts)
+                if count:
+                    last = starts + self.index["count"] - 1
+                    self.index["t_start"] = self.records["time"][starts]
+                    self.index["t_end"] = self.records["time"][last]
+            else:
+                self.records = None
+                self.index = read_index(self.file, header)
+        except Exception:
+            self.close()
+            raise
+        # Logical position of each chunk's first sample
+        self.starts = np.concatenate(([0], np.cumsum(self.index["count"], dtype=np.int64)))
+
+    def close(self):
+        self.records = None
+        mm = getattr(self, "mm", None)
+        if mm is not None:
+            try:
+                mm.close()
+            except BufferError:
+                # Views handed out earlier are still alive; the mapping is
+                # released when they are garbage collected
+                pass
+            self.mm = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    @property
+    def duration(self):
+        if len(self.index) == 0:
+            return 0.0
+        return float(self.index["t_end"][-1] - self.index["t_start"][0])
+
+    def time_range(self):
+        if len(self.index) == 0:
+            return None
+        return float(self.index["t_start"][0]), float(self.index["t_end"][-1])
+
+    def chunk(self, i):
+        """(time, duty, current) of chunk i; duty and current are views into the file."""
+        entry = self.index[i]
+        count = int(entry["count"])
+        if self.records is not None:
+            start = int(self.starts[i])
+            block = self.records[start:start + count]
+            return block["time"], block["duty"], block["current"]
+        offset = int(entry["offset"]) + CHUNK_HEADER.size
+        data = np.frombuffer(self.mm, dtype="<u2", count=2 * count, offset=offset)
+        return chunk_times(entry["t_start"], entry["t_end"], count), data[:count], data[count:]
+
+    def chunks(self, start=0, stop=None):
+        """Iterate over (time, duty, current) per chunk."""
+        stop = len(self.index) if stop is None else stop
+        for i in range(start, stop):
+            yield self.chunk(i)
+
+    def _gather(self, first, last, select):
+        parts = []
+        for i in range(first, last):
+            t, duty, current = self.chunk(i)
+            keep = select(i, t)
+            parts.append((t[keep], duty[keep], current[keep]))
+        if not parts:
+            return np.empty(0), np.empty(0, dtype="<u2"), np.empty(0, dtype="<u2")
+        if len(parts) == 1:
+            return parts[0]
+        return tuple(np.concatenate(col) for col in zip(*parts))
+
+    def __getitem__(self, key):
+        """Samples by position: sf[a:b] -> (time, duty, current)."""
+        if not isinstance(key, slice):
+            raise TypeError("StreamFile supports slice indexing only")
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("StreamFile slices must be contiguous")
+        if start >= stop:
+            return self._gather(0, 0, None)
+        first = int(np.searchsorted(self.starts, start, side="right")) - 1
+        last = int(np.searchsorted(self.starts, stop, side="left"))
+        return self._gather(first, last, lambda i, t: slice(
+            max(0, start - int(self.starts[i])), stop - int(self.starts[i])))
+
+    def slice_time(self, t0, t1):
+        """Samples with t0 <= t <= t1 as (time, duty, current); only the chunks overlapping the range are touched."""
+        first = int(np.searchsorted(self.index["t_end"], t0, side="left"))
+        last = int(np.searchsorted(self.index["t_start"], t1, side="right"))
+
+        def select(i, t):
+            a = int(np.searchsorted(t, t0, side="left"))
+            b = int(np.searchsorted(t, t1, side="right"))
+            return slice(a, b)
+        return self._gather(first, max(first, last), select)
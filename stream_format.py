@@ -0,0 +1,134 @@
+# === stream_format.py ===
+# On-disk layout of StreamHandler recordings (.bin).
+#
+# Every version starts with STRM_HEADER: magic b"STRM", version, sample rate,
+# ADC bit depth.
+#
+# v2: header, then interleaved 12-byte records (uint16 duty, uint16 current,
+#     float64 seconds since start).
+#
+# v3: header, V3_HEADER (chunk capacity, start time as epoch seconds), then
+#     chunks of up to chunk capacity samples:
+#         CHUNK_HEADER  magic b"CHNK", start tick (index of the first sample),
+#                       count, time of first and of last sample
+#         duty[count]   uint16
+#         current[count] uint16
+#     Sample times inside a chunk are linear between its first and last
+#     time; the writer starts a new chunk wherever that would be off by more
+#     than half a sample period. A closed file ends with an index of all
+#     chunks and a trailer pointing to it; a file without trailer (still
+#     being written, or cut short) is read by scanning chunk headers.
+#     Every flush of an open file appends a CHECKPOINT record after the
+#     chunks it wrote, once they are fsynced, giving its own offset (the
+#     durable data end) and the sample count so far. Checkpoints stay in
+#     the file between chunks; the index skips them and recovery cuts an
+#     unclosed file back to the last one.
+import os
+import struct
+import zlib
+
+import numpy as np
+
+STRM_MAGIC = b"STRM"
+STRM_HEADER = struct.Struct("<4sIfH")
+V3_HEADER = struct.Struct("<Id")
+CHUNK_MAGIC = b"CHNK"
+CHUNK_HEADER = struct.Struct("<4sQIdd")
+INDEX_MAGIC = b"SIDX"
+INDEX_ENTRY = struct.Struct("<QQIdd")  # file offset, start tick, count, t_start, t_end
+TRAILER = struct.Struct("<QI4s")       # index offset, chunk count, magic
+TRAILER_MAGIC = b"SEND"
+CHECKPOINT = struct.Struct("<4sQQI")  # magic, data end offset, samples, crc32
+CHECKPOINT_MAGIC = b"SCHK"
+
+RECORD_DTYPE = np.dtype([("duty", "<u2"), ("current", "<u2"), ("time", "<f8")])
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("start_tick", "<u8"), ("count", "<u4"),
+                        ("t_start", "<f8"), ("t_end", "<f8")])
+
+DEFAULT_CHUNK_SAMPLES = 65536
+
+
+def read_header(f):
+    """
+    Read the file header from the start of f. Returns a dict with version,
+    sample_rate, bit_depth, data_offset and, for v3, chunk_samples and
+    start_time.
+    """
+    f.seek(0)
+    raw = f.read(STRM_HEADER.size)
+    if len(raw) < STRM_HEADER.size:
+        raise ValueError("File too short for header")
+    magic, version, sample_rate, bit_depth = STRM_HEADER.unpack(raw)
+    if magic != STRM_MAGIC:
+        raise ValueError("Invalid file header")
+    header = {"version": version, "sample_rate": sample_rate, "bit_depth": bit_depth,
+              "data_offset": STRM_HEADER.size}
+    if version == 3:
+        raw = f.read(V3_HEADER.size)
+        if len(raw) < V3_HEADER.size:
+            raise ValueError("File too short for header")
+        header["chunk_samples"], header["start_time"] = V3_HEADER.unpack(raw)
+        header["data_offset"] += V3_HEADER.size
+    elif version != 2:
+        raise ValueError(f"Unsupported STRM version {version}")
+    return header
+
+
+def checkpoint_crc(magic, data_end, samples):
+    return zlib.crc32(struct.pack("<4sQQ", magic, data_end, samples))
+
+
+def read_checkpoint(f, offset):
+    """(data_end, samples) of a valid checkpoint record at offset, else None."""
+    f.seek(offset)
+    raw = f.read(CHECKPOINT.size)
+    if len(raw) < CHECKPOINT.size:
+        return None
+    magic, data_end, samples, crc = CHECKPOINT.unpack(raw)
+    if magic != CHECKPOINT_MAGIC or crc != checkpoint_crc(magic, data_end, samples):
+        return None
+    return data_end, samples
+
+
+def read_index(f, header):
+    """
+    Chunk index of a v3 file as an INDEX_DTYPE array: from the footer if the
+    file was closed cleanly, otherwise by scanning the chunk headers.
+    """
+    size = f.seek(0, os.SEEK_END)
+    if size >= header["data_offset"] + TRAILER.size:
+        f.seek(size - TRAILER.size)
+        index_offset, n_chunks, magic = TRAILER.unpack(f.read(TRAILER.size))
+        expected = 4 + n_chunks * INDEX_ENTRY.size
+        if magic == TRAILER_MAGIC and index_offset + expected == size - TRAILER.size:
+            f.seek(index_offset)
+            raw = f.read(expected)
+            if raw[:4] == INDEX_MAGIC:
+                return np.frombuffer(raw[4:], dtype=INDEX_DTYPE).copy()
+    return scan_chunks(f, header)
+
+
+def scan_chunks(f, header):
+    """Rebuild the chunk index by walking the chunk headers; stops at the first incomplete chunk."""
+    size = f.seek(0, os.SEEK_END)
+    entries = []
+    offset = header["data_offset"]
+    while offset + CHUNK_HEADER.size <= size:
+        f.seek(offset)
+        magic, start_tick, count, t_start, t_end = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+        if magic == CHECKPOINT_MAGIC and read_checkpoint(f, offset) is not None:
+            offset += CHECKPOINT.size
+            continue
+        end = offset + CHUNK_HEADER.size + 4 * count
+        if magic != CHUNK_MAGIC or count > header["chunk_samples"] or end > size:
+            break
+        entries.append((offset, start_tick, count, t_start, t_end))
+        offset = end
+    return np.array(entries, dtype=INDEX_DTYPE)
+
+
+def chunk_times(t_start, t_end, count):
+    """Per-sample times of a chunk."""
+    if count == 1:
+        return np.array([t_start])
+    return np.linspace(t_start, t_end, count)
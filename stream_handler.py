@@ -1,19 +1,26 @@
 # === stream_handler.py ===
 import os
-import struct
 import threading
 import time
 from datetime import datetime
 
+import numpy as np
+
+from clock_sync import ClockSync
+from decimate import decimate
+from ring_buffer import RingBuffer
+from stream_export import export_recording
+from stream_writer import StreamWriter
+from summary_pyramid import SummaryPyramid
+
 class StreamHandler:
-    def __init__(self, controller, binary_dir="stream_data", buffer_size=100000, sample_rate=None):
+    def __init__(self, controller, binary_dir="stream_data", buffer_size=100000, sample_rate=None,
+                 prefix="stream", segment_seconds=3600, segment_bytes=1 << 30):
         self.controller = controller
         self.buffer_size = buffer_size
-        self.duty_buffer = [0] * buffer_size
-        self.current_buffer = [0] * buffer_size
-        self.timestamps = [0.0] * buffer_size
-        self.write_index = 0
-        self.sample_count = 0
+        self.ring = RingBuffer(buffer_size, duty=np.uint16, current=np.uint16, time=np.float64)
+        # Whole-session min/max/mean summaries for zoomed-out views
+        self.pyramid = SummaryPyramid(duty=np.uint16, current=np.uint16)
         self.lock = threading.Lock()
         self.streaming = False
 
@@ -25,23 +32,44 @@ class StreamHandler:
                 self.sample_rate = 10000.0
         else:
             self.sample_rate = sample_rate
+        self.clock = ClockSync(self.sample_rate)
 
         os.makedirs(binary_dir, exist_ok=True)
-        self.binary_filename = os.path.join(
-            binary_dir, datetime.now().strftime("stream_%Y%m%d_%H%M%S.bin")
-        )
-        self.bin_file = open(self.binary_filename, "wb")
+        self.binary_dir = binary_dir
+        self.prefix = prefix
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self._open_recording()
 
-        self.header_written = False
         self.start_time = None
         self.thread = None
 
-    def start(self):
+    def _open_recording(self):
+        self.binary_filename = os.path.join(
+            self.binary_dir, datetime.now().strftime(f"{self.prefix}_%Y%m%d_%H%M%S.bin")
+        )
+        self.writer = StreamWriter(self.binary_filename, self.sample_rate,
+                                   segment_seconds=self.segment_seconds, segment_bytes=self.segment_bytes)
+
+    def start(self, start_time=None):
+        """
+        Start streaming. Timestamps are relative to start_time (defaults to
+        now); pass a shared value to put several devices on one timeline.
+        """
         if self.streaming:
             return
+        if self.writer.thread is None:
+            # The previous recording was closed by stop(); start a new one
+            self._open_recording()
+        with self.lock:
+            # Timestamps restart from the new start_time
+            self.ring.clear()
+            self.pyramid.clear()
+        self.clock.reset()
         self.controller.start_streaming()
         self.streaming = True
-        self.start_time = time.time()
+        self.start_time = start_time if start_time is not None else time.time()
+        self.writer.start_time = self.start_time
         self.thread = threading.Thread(target=self._stream_loop, daemon=True)
         self.thread.start()
 
@@ -53,102 +81,112 @@ class StreamHandler:
             self.controller.stop_streaming()
         except Exception as e:
             print(f"[Warning] stop_streaming ACK error: {e}")
-        if self.bin_file:
-            self.bin_file.close()
-            self.bin_file = None
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        self.writer.close()
+        if self.writer.dropped_batches:
+            print(f"[Warning] Recording dropped {self.writer.dropped_batches} batches (disk too slow)")
 
-    def _write_header(self):
-        header = struct.pack("<4sIfH", b"STRM", 2, self.sample_rate, 10)
-        self.bin_file.write(header)
-        self.header_written = True
+    @property
+    def sample_count(self):
+        return self.ring.count
 
-    def _write_samples(self, samples, rel_time):
-        if not self.header_written:
-            self._write_header()
-        for duty, current in samples:
-            self.bin_file.write(struct.pack("<HHd", duty, current, rel_time))
+    def clock_stats(self):
+        """Device clock offset/drift as recovered from the time sync packets."""
+        return self.clock.stats()
 
     def _stream_loop(self):
         while self.streaming:
-            pkt = self.controller.read_stream_packet(timeout=0.2)
-            if pkt is None:
+            batch = self.controller.read_stream_packets(timeout=0.2)
+            if batch is None:
                 continue
-            typ, data = pkt
-            if typ == "data":
-                now = time.time() - self.start_time
-                samples = data["samples"]
-                with self.lock:
-                    for duty, current in samples:
-                        self.duty_buffer[self.write_index] = duty
-                        self.current_buffer[self.write_index] = current
-                        self.timestamps[self.write_index] = now
-                        self.write_index = (self.write_index + 1) % self.buffer_size
-                        self.sample_count += 1
-                self._write_samples(samples, now)
+            first = self.ring.count
+            for _, micros, index, received in batch["time"]:
+                self.clock.add_sync(micros, received, first + index)
+            duty, current = batch["duty"], batch["current"]
+            if len(duty) == 0:
+                continue
+            received = batch["time"][-1][3] if batch["time"] else time.time()
+            rel_time = self.clock.timestamps(first, len(duty), received, origin=self.start_time)
+            with self.lock:
+                self.ring.extend(duty=duty, current=current, time=rel_time)
+                self.pyramid.extend(rel_time, duty=duty, current=current)
+            self.writer.write(duty, current, rel_time)
             time.sleep(0.001)
 
+    @property
+    def segment_files(self):
+        """
+        Files of this recording, in order (more than one once it has
+        rotated); empty until the first samples reach the writer.
+        """
+        return list(self.writer.segments)
+
     def export_csv(self, output_filename):
-        import csv
-        record_size = 12  # 2 bytes duty, 2 bytes current, 8 bytes timestamp
-        header_size = 12  # 4sIfH
-        with open(self.binary_filename, "rb") as f:
-            header = f.read(header_size)
-            if len(header) < header_size:
-                raise ValueError("File too short for header")
-            magic, version, sample_rate, bit_depth = struct.unpack("<4sIfH", header)
-            if magic != b"STRM":
-                raise ValueError("Invalid file header")
-            with open(output_filename, "w", newline="") as csv_file:
-                writer = csv.writer(csv_file)
-                writer.writerow(["timestamp", "duty", "current"])
-                while True:
-                    chunk = f.read(record_size)
-                    if not chunk:
-                        break
-                    if len(chunk) < record_size:
-                        # Print warning and skip incomplete record
-                        print(f"[Warning] Incomplete record of {len(chunk)} bytes at end of file, skipping.")
-                        break
-                    try:
-                        duty, current, t = struct.unpack("<HHd", chunk)
-                        writer.writerow([t, duty, current])
-                    except struct.error as e:
-                        print(f"[Warning] Skipping corrupt record: {e}")
-                        continue
+        export_recording(self.segment_files, output_filename, "csv")
 
     def get_recent_data(self, max_points):
         with self.lock:
-            if self.sample_count < max_points:
-                indices = list(range(self.sample_count))
-            else:
-                start = (self.write_index - max_points) % self.buffer_size
-                indices = [(start + i) % self.buffer_size for i in range(max_points)]
-            return (
-                [self.timestamps[i] for i in indices],
-                [self.duty_buffer[i] for i in indices],
-                [self.current_buffer[i] for i in indices],
-            )
+            data = self.ring.latest(max_points)
+            return data["time"].tolist(), data["duty"].tolist(), data["current"].tolist()
 
     def get_last_timestamp(self):
         with self.lock:
-            if self.sample_count == 0:
-                return None
-            idx = (self.write_index - 1) % self.buffer_size
-            return self.timestamps[idx]
+            return self.ring.last("time")
 
     def get_samples_by_time(self, t0, t1):
+        """
+        Samples with t0 <= t <= t1 as (time, duty, current) arrays.
+        Timestamps are monotonic, so the window is found by binary search
+        and only the samples inside it are copied.
+        """
         with self.lock:
-            if self.sample_count == 0:
-                return [], [], []
-            if self.sample_count < self.buffer_size:
-                indices = list(range(self.sample_count))
+            i0 = self.ring.searchsorted("time", t0, side="left")
+            i1 = self.ring.searchsorted("time", t1, side="right")
+            return (
+                np.array(self.ring.ordered("time", i0, i1)),
+                np.array(self.ring.ordered("duty", i0, i1)),
+                np.array(self.ring.ordered("current", i0, i1)),
+            )
+
+    def get_decimated(self, t0, t1, width, method="minmax", out=None):
+        """
+        Samples in [t0, t1] reduced to about 2 * width points per series
+        for plotting. Returns ((t, duty), (t, current)); each series keeps
+        its own peaks, so their time axes differ. out, if given, holds
+        preallocated float64 buffers ((t, duty), (t, current)) to write
+        into; the results are then views of them.
+        """
+        out = out or (None, None)
+        with self.lock:
+            i0 = self.ring.searchsorted("time", t0, side="left")
+            i1 = self.ring.searchsorted("time", t1, side="right")
+            oldest = self.ring.ordered("time", 0, 1)
+            in_ring = len(oldest) and oldest[0] <= t0
+            if in_ring and i1 - i0 <= 2 * width * self.pyramid.base:
+                t = self.ring.ordered("time", i0, i1)
+                return (decimate(t, self.ring.ordered("duty", i0, i1), width, method, out[0]),
+                        decimate(t, self.ring.ordered("current", i0, i1), width, method, out[1]))
+            # Older than the ring or too many samples: serve from the pyramid
+            _, buckets = self.pyramid.query(t0, t1, width)
+            return tuple(self._summary_series(buckets, name, method, bufs)
+                         for name, bufs in zip(("duty", "current"), out))
+
+    @staticmethod
+    def _summary_series(buckets, name, method, out=None):
+        n = len(buckets["t"])
+        if method == "lttb":
+            size, columns = n, (buckets["t"], buckets[f"{name}_mean"])
+        else:
+            # Each bucket becomes a vertical min-max segment
+            size = 2 * n
+            columns = ((buckets["t"], buckets["t"]), (buckets[f"{name}_min"], buckets[f"{name}_max"]))
+        series = []
+        for values, buf in zip(columns, out or (None, None)):
+            dst = buf[:size] if buf is not None and len(buf) >= size else np.empty(size, dtype=np.float64)
+            if method == "lttb":
+                dst[:] = values
             else:
-                indices = [(self.write_index + i) % self.buffer_size for i in range(self.buffer_size)]
-            ts = [self.timestamps[i] for i in indices]
-            duty = [self.duty_buffer[i] for i in indices]
-            current = [self.current_buffer[i] for i in indices]
-            filtered = [(t, d, c) for t, d, c in zip(ts, duty, current) if t0 <= t <= t1]
-            if not filtered:
-                return [], [], []
-            ts_f, d_f, c_f = zip(*filtered)
-            return list(ts_f), list(d_f), list(c_f)
\ No newline at end of file
+                dst[0::2], dst[1::2] = values
+            series.append(dst)
+        return tuple(series)
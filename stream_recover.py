@@ -0,0 +1,91 @@
+# === stream_recover.py ===
+# Closes STRM v3 recordings left open by a crash or power loss:
+#
+#   python stream_recover.py stream_data/stream_20250101_120000*.bin
+#
+# The chunk headers are walked up to the first incomplete chunk, the file is
+# cut back to the last checkpoint (everything before it was fsynced; a chunk
+# after it may have a header over data that never reached the disk) and the
+# chunk index and trailer are appended, so StreamFile and the exporters open
+# it like any cleanly closed recording.
+import os
+
+from stream_format import (
+    CHECKPOINT, CHUNK_HEADER, INDEX_ENTRY, INDEX_MAGIC, TRAILER, TRAILER_MAGIC,
+    read_checkpoint, read_header, read_index,
+)
+
+
+def recover_segment(path, dry_run=False):
+    """
+    Rebuild the index of one segment. Returns a dict with status
+    ("closed", "recovered" or "unsupported"), chunks, samples, the sample
+    count of the last checkpoint found and the number of bytes dropped.
+    """
+    with open(path, "rb" if dry_run else "r+b") as f:
+        header = read_header(f)
+        size = f.seek(0, os.SEEK_END)
+        result = {"path": path, "chunks": 0, "samples": 0, "checkpoint_samples": None,
+                  "dropped_bytes": 0}
+        if header["version"] != 3:
+            return dict(result, status="unsupported")
+
+        index = read_index(f, header)
+        closed = size >= TRAILER.size and _has_trailer(f, size)
+        result["chunks"] = len(index)
+        result["samples"] = int(index["count"].sum()) if len(index) else 0
+        if closed:
+            return dict(result, status="closed")
+
+        # Checkpoints sit where a chunk ends; the last valid one whose
+        # recorded offset is its own position marks the durable data end
+        ends = [header["data_offset"]] + [offset + CHUNK_HEADER.size + 4 * count for offset, count
+                                          in zip(index["offset"].tolist(), index["count"].tolist())]
+        end = header["data_offset"]
+        for pos in reversed(ends):
+            checkpoint = read_checkpoint(f, pos)
+            if checkpoint is not None and checkpoint[0] == pos:
+                end = pos
+                result["checkpoint_samples"] = checkpoint[1]
+                break
+        index = index[index["offset"] < end]
+        result["chunks"] = len(index)
+        result["samples"] = int(index["count"].sum()) if len(index) else 0
+        result["dropped_bytes"] = size - end
+        if result["checkpoint_samples"] is not None:
+            result["dropped_bytes"] -= CHECKPOINT.size
+        if not dry_run:
+            f.seek(end)
+            f.truncate()
+            f.write(INDEX_MAGIC + b"".join(INDEX_ENTRY.pack(*entry.tolist()) for entry in index))
+            f.write(TRAILER.pack(end, len(index), TRAILER_MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        return dict(result, status="recovered")
+
+
+def _has_trailer(f, size):
+    f.seek(size - TRAILER.size)
+    return TRAILER.unpack(f.read(TRAILER.size))[2] == TRAILER_MAGIC
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Close STRM recordings left open by a crash")
+    parser.add_argument("files", nargs="+", help=".bin segments to check")
+    parser.add_argument("--dry-run", action="store_true", help="report only, do not modify files")
+    args = parser.parse_args()
+
+    for path in args.files:
+        try:
+            r = recover_segment(path, dry_run=args.dry_run)
+        except (OSError, ValueError) as e:
+            print(f"{path}: {e}")
+            continue
+        line = f"{path}: {r['status']}, {r['chunks']} chunks, {r['samples']} samples"
+        if r["checkpoint_samples"] is not None:
+            line += f" (last checkpoint {r['checkpoint_samples']})"
+        if r["dropped_bytes"]:
+            line += f", {r['dropped_bytes']} trailing bytes dropped"
+        print(line)
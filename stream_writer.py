@@ -0,0 +1,224 @@
+# === stream_writer.py ===
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from stream_format import (
+    CHECKPOINT, CHECKPOINT_MAGIC, CHUNK_HEADER, CHUNK_MAGIC, DEFAULT_CHUNK_SAMPLES, INDEX_ENTRY,
+    INDEX_MAGIC, STRM_HEADER, STRM_MAGIC, TRAILER, TRAILER_MAGIC, V3_HEADER, checkpoint_crc,
+)
+
+
+class StreamWriter:
+    """
+    Writes StreamHandler recordings (STRM v3, see stream_format.py) from a
+    dedicated I/O thread.
+
+    write() only enqueues the NumPy batch, so the serial side never waits
+    on the disk. The I/O thread packs samples into columnar chunks and
+    hands them to the file once flush_bytes have built up or flush_interval
+    has passed; a time-based flush closes the open chunk early. When the
+    disk falls behind and the queue is full, the batch is dropped and
+    counted in dropped_batches; the live view in memory is unaffected.
+
+    Every flush fsyncs the new chunks and then appends a checkpoint record
+    (data end, sample count), so a crash or power loss costs at most
+    flush_interval of data; stream_recover.py closes such a file at its
+    last checkpoint. The recording rotates to a
+    new segment (name_001.bin, name_002.bin, ...) once a segment reaches
+    segment_bytes or segment_seconds.
+    """
+
+    def __init__(self, filename, sample_rate, bit_depth=10, queue_size=256,
+                 flush_bytes=1 << 20, flush_interval=1.0, chunk_samples=DEFAULT_CHUNK_SAMPLES,
+                 segment_bytes=1 << 30, segment_seconds=None, fsync=True):
+        self.base_filename = filename
+        self.filename = filename
+        self.segments = []  # every file written so far, in order
+        self.sample_rate = sample_rate
+        self.bit_depth = bit_depth
+        self.start_time = 0.0  # epoch seconds of t = 0, stored in the header
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.chunk_samples = chunk_samples
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.fsync = fsync
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped_batches = 0
+        self.file_writes = 0
+        self.bytes_written = 0
+        self.samples_written = 0
+        self.error = None
+
+        # Open chunk
+        self.duty = np.empty(chunk_samples, dtype="<u2")
+        self.current = np.empty(chunk_samples, dtype="<u2")
+        self.fill = 0
+        self.t_start = self.t_end = 0.0
+        self.period = None  # seconds per sample in the open chunk
+        # Current segment
+        self.file = None
+        self.index = []
+        self.offset = 0        # file offset of the next byte handed to pending
+        self.segment_started = 0.0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, duty, current, rel_time):
+        """Queue one batch of samples; never blocks."""
+        try:
+            self.queue.put_nowait((duty, current, rel_time))
+        except queue.Full:
+            self.dropped_batches += 1
+
+    def close(self):
+        """Write everything still queued, the chunk index, and close the file."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    # === I/O thread ===
+
+    def _segment_name(self, number):
+        if number == 0:
+            return self.base_filename
+        root, ext = os.path.splitext(self.base_filename)
+        return f"{root}_{number:03d}{ext}"
+
+    def _open_segment(self, pending):
+        self.filename = self._segment_name(len(self.segments))
+        self.file = open(self.filename, "wb")
+        self.segments.append(self.filename)
+        self.segment_started = time.monotonic()
+        self.index = []
+        pending += (STRM_HEADER.pack(STRM_MAGIC, 3, self.sample_rate, self.bit_depth) +
+                    V3_HEADER.pack(self.chunk_samples, self.start_time))
+        self.offset = len(pending)
+
+    def _segment_full(self):
+        if self.file is None:
+            return False
+        if self.offset >= self.segment_bytes:
+            return True
+        return (self.segment_seconds is not None and
+                time.monotonic() - self.segment_started >= self.segment_seconds)
+
+    def _finish_segment(self, pending):
+        """Write the open chunk, the chunk index and trailer, and close the segment."""
+        self._close_chunk(pending)
+        index_offset = self.offset
+        pending += INDEX_MAGIC + b"".join(INDEX_ENTRY.pack(*e) for e in self.index)
+        pending += TRAILER.pack(index_offset, len(self.index), TRAILER_MAGIC)
+        self._flush(pending, final=True)
+        pending.clear()
+        self.file.close()
+        self.file = None
+
+    def _append(self, pending, duty, current, t):
+        # Samples go into the open chunk while they stay within half a
+        # sample period of its line (start time + index * period)
+        tol = 0.5 / self.sample_rate
+        pos = 0
+        while pos < len(t):
+            seg = t[pos:pos + self.chunk_samples - self.fill]
+            if self.fill == 0:
+                self.t_start = float(seg[0])
+                self.period = float(seg[1] - seg[0]) if len(seg) > 1 else None
+            elif self.period is None:
+                self.period = float(seg[0]) - self.t_start
+            period = self.period or 0.0
+            pred = self.t_start + (self.fill + np.arange(len(seg))) * period
+            bad = np.flatnonzero(np.abs(seg - pred) > tol)
+            take = int(bad[0]) if len(bad) else len(seg)
+            if take:
+                self.duty[self.fill:self.fill + take] = duty[pos:pos + take]
+                self.current[self.fill:self.fill + take] = current[pos:pos + take]
+                self.fill += take
+                self.t_end = float(seg[take - 1])
+                pos += take
+            if take < len(seg) or self.fill == self.chunk_samples:
+                self._close_chunk(pending)
+
+    def _close_chunk(self, pending):
+        if self.fill == 0:
+            return
+        entry = (self.offset, self.samples_written, self.fill, self.t_start, self.t_end)
+        data = (CHUNK_HEADER.pack(CHUNK_MAGIC, *entry[1:]) +
+                self.duty[:self.fill].tobytes() + self.current[:self.fill].tobytes())
+        pending += data
+        self.offset += len(data)
+        self.index.append(entry)
+        self.samples_written += self.fill
+        self.fill = 0
+        self.period = None
+
+    def _run(self):
+        pending = bytearray()
+        last_flush = time.monotonic()
+        closing = False
+        while not closing:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                closing = True
+            elif item:
+                if self.file is None:
+                    self._open_segment(pending)
+                duty, current, t = item
+                self._append(pending, duty, current, np.asarray(t, dtype=np.float64))
+
+            if self.file is None:
+                last_flush = time.monotonic()
+                continue
+            due = time.monotonic() - last_flush >= self.flush_interval
+            if closing or self._segment_full():
+                self._finish_segment(pending)
+                last_flush = time.monotonic()
+                continue
+            if due:
+                self._close_chunk(pending)
+            if pending and (due or len(pending) >= self.flush_bytes):
+                self._flush(pending)
+                pending.clear()
+                last_flush = time.monotonic()
+            elif due:
+                last_flush = time.monotonic()
+
+    def _flush(self, data, final=False):
+        """
+        Append data and fsync, then (unless this is the final trailer)
+        append a checkpoint for it and fsync again, so a checkpoint on disk
+        only ever covers data that is on disk too.
+        """
+        if self.error is not None:
+            return
+        try:
+            self.file.write(data)
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            if not final:
+                samples = sum(entry[2] for entry in self.index)
+                record = (CHECKPOINT_MAGIC, self.offset, samples)
+                self.file.write(CHECKPOINT.pack(*record, checkpoint_crc(*record)))
+                self.offset += CHECKPOINT.size
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+        except OSError as e:
+            # Keep draining the queue so the producer is never blocked
+            self.error = e
+            print(f"[Warning] Stream recording to {self.filename} failed: {e}")
+            return
+        self.file_writes += 1
+        self.bytes_written += len(data)
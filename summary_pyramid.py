@@ -0,0 +1,193 @@
+# === summary_pyramid.py ===
+import numpy as np
+
+
+class _Level:
+    """Growable column store for one pyramid level."""
+
+    def __init__(self, dtypes, capacity=1024):
+        self.size = 0
+        self.dropped = 0  # oldest buckets discarded so far
+        self.data = {name: np.empty(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+
+    def append(self, values):
+        n = len(values["t"])
+        if self.size + n > len(self.data["t"]):
+            capacity = max(2 * len(self.data["t"]), self.size + n)
+            for name, col in self.data.items():
+                grown = np.empty(capacity, dtype=col.dtype)
+                grown[:self.size] = col[:self.size]
+                self.data[name] = grown
+        for name, col in self.data.items():
+            col[self.size:self.size + n] = values[name]
+        self.size += n
+
+    def discard(self, n):
+        """Drop the n oldest buckets."""
+        for col in self.data.values():
+            col[:self.size - n] = col[n:self.size]
+        self.size -= n
+        self.dropped += n
+
+    def view(self, name, start=0, stop=None):
+        stop = self.size if stop is None else min(stop, self.size)
+        return self.data[name][start:stop]
+
+
+class SummaryPyramid:
+    """
+    Min/max/mean summaries of a sample stream at power-of-two resolutions.
+
+    Level 0 buckets cover `base` samples, level L covers base * 2**L. Each
+    bucket stores the time of its first sample and, per column, min, max
+    and mean. Batches are folded in as they arrive (amortized O(batch)),
+    and the pyramid covers the whole session, not just the in-memory ring.
+    Each level keeps at most about `max_buckets` (the newest); older ones
+    are dropped once folded into the next level, so fine resolution is
+    only kept for recent data and memory grows with the log of the
+    session length (~3 MB per level for two uint16 columns).
+
+        pyr = SummaryPyramid(duty=np.uint16, current=np.uint16)
+        pyr.extend(t, duty=d, current=c)
+        level, buckets = pyr.query(0, now, width=800)
+    """
+
+    def __init__(self, base=64, max_buckets=1 << 16, **columns):
+        self.base = base
+        self.max_buckets = max_buckets
+        self.columns = columns
+        self.dtypes = {"t": np.float64}
+        for name, dtype in columns.items():
+            self.dtypes[f"{name}_min"] = dtype
+            self.dtypes[f"{name}_max"] = dtype
+            self.dtypes[f"{name}_mean"] = np.float32
+        self.clear()
+
+    def clear(self):
+        self.levels = [_Level(self.dtypes)]
+        self.merged = [0]  # per level: buckets already folded into the next level
+        self.tail = None   # samples not yet filling a level 0 bucket
+        self.samples = 0
+
+    def extend(self, t, **values):
+        t = np.asarray(t, dtype=np.float64)
+        if len(t) == 0:
+            return
+        self.samples += len(t)
+        if self.tail is not None:
+            t = np.concatenate((self.tail["t"], t))
+            values = {name: np.concatenate((self.tail[name], values[name])) for name in self.columns}
+
+        full = len(t) // self.base * self.base
+        self.tail = {"t": t[full:].copy()}
+        for name in self.columns:
+            self.tail[name] = np.asarray(values[name][full:]).copy()
+        if full == 0:
+            return
+
+        n = full // self.base
+        buckets = {"t": t[:full:self.base]}
+        for name in self.columns:
+            grid = np.asarray(values[name][:full]).reshape(n, self.base)
+            buckets[f"{name}_min"] = grid.min(axis=1)
+            buckets[f"{name}_max"] = grid.max(axis=1)
+            buckets[f"{name}_mean"] = grid.mean(axis=1)
+        self.levels[0].append(buckets)
+        self._fold(0)
+
+    def _fold(self, level):
+        # Merge complete pairs of this level into the next one
+        while True:
+            src = self.levels[level]
+            pairs = (src.size - self.merged[level]) // 2
+            if pairs == 0:
+                return
+            if level + 1 == len(self.levels):
+                self.levels.append(_Level(self.dtypes))
+                self.merged.append(0)
+            a, b = self.merged[level], self.merged[level] + 2 * pairs
+            merged = {"t": src.view("t", a, b)[::2]}
+            for name in self.columns:
+                merged[f"{name}_min"] = src.view(f"{name}_min", a, b).reshape(pairs, 2).min(axis=1)
+                merged[f"{name}_max"] = src.view(f"{name}_max", a, b).reshape(pairs, 2).max(axis=1)
+                merged[f"{name}_mean"] = src.view(f"{name}_mean", a, b).reshape(pairs, 2).mean(axis=1)
+            self.levels[level + 1].append(merged)
+            self.merged[level] = b
+            # Drop folded history in bulk so the shift is amortized
+            if src.size > 2 * self.max_buckets:
+                drop = min(self.merged[level], src.size - self.max_buckets)
+                src.discard(drop)
+                self.merged[level] -= drop
+            level += 1
+
+    def level_for(self, t0, t1, width):
+        """
+        Coarsest-needed level: the finest one that still reaches back to t0
+        and has at most `width` buckets in [t0, t1].
+        """
+        last = len(self.levels) - 1
+        for level, lv in enumerate(self.levels):
+            t = lv.view("t")
+            if level < last and lv.dropped and (len(t) == 0 or t[0] > t0):
+                continue
+            count = np.searchsorted(t, t1, side="right") - np.searchsorted(t, t0, side="left")
+            if count <= width or level == last:
+                return level
+        return last
+
+    def query(self, t0, t1, width):
+        """
+        Buckets overlapping [t0, t1] at the level that gives about `width`
+        of them, ending with one partial bucket for the samples not yet
+        folded into that level. Returns (level, {column: array}) with views
+        into the pyramid where possible; copy what you keep beyond the
+        owner's lock.
+        """
+        level = self.level_for(t0, t1, width)
+        lv = self.levels[level]
+        t = lv.view("t")
+        # Include the bucket that starts before t0 but extends into it
+        a = max(0, int(np.searchsorted(t, t0, side="right")) - 1)
+        b = int(np.searchsorted(t, t1, side="right"))
+        buckets = {name: lv.view(name, a, b) for name in self.dtypes}
+        partial = self._partial(level)
+        if partial is not None and partial["t"][0] <= t1:
+            buckets = {name: np.concatenate((col, partial[name].astype(col.dtype)))
+                       for name, col in buckets.items()}
+        return level, buckets
+
+    def _partial(self, level):
+        """
+        One bucket summarizing everything newer than the last bucket of
+        `level`: the unpaired buckets of the finer levels plus the tail.
+        """
+        parts = []
+        for finer in range(level):
+            lv = self.levels[finer]
+            a = self.merged[finer]
+            if a < lv.size:
+                weight = self.base << finer
+                parts.append(({name: lv.view(name, a) for name in self.dtypes}, weight))
+        if self.tail is not None and len(self.tail["t"]):
+            tail = {"t": self.tail["t"][:1]}
+            for name in self.columns:
+                col = self.tail[name]
+                tail[f"{name}_min"] = col.min(keepdims=True)
+                tail[f"{name}_max"] = col.max(keepdims=True)
+                tail[f"{name}_mean"] = np.array([col.mean()])
+            parts.append((tail, len(self.tail["t"])))
+        if not parts:
+            return None
+        # Weight bucket means by the samples they cover
+        weights = np.concatenate([np.full(len(p["t"]), w, dtype=np.float64) for p, w in parts])
+        merged = {"t": np.array([min(p["t"].min() for p, _ in parts)])}
+        for name in self.columns:
+            merged[f"{name}_min"] = np.array([min(p[f"{name}_min"].min() for p, _ in parts)])
+            merged[f"{name}_max"] = np.array([max(p[f"{name}_max"].max() for p, _ in parts)])
+            means = np.concatenate([p[f"{name}_mean"] for p, _ in parts]).astype(np.float64)
+            merged[f"{name}_mean"] = np.array([np.average(means, weights=weights)])
+        return merged
+
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for lv in self.levels for col in lv.data.values())
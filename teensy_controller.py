@@ -3,9 +3,16 @@ import serial
 import struct
 import time
 import logging
+import threading
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from config import serial_port, baudrate
 from gui.logger import log
 from gui.device_panel import STATUS_BUTTON_TAG, STATUS_GROUP_TAG, on_status_pressed
+from stream_decoder import StreamDecoder
+from crc8 import crc8
+from serial_reader import SerialReader
+from packet_capture import PacketCapture, CaptureTransport
 
 
 # === Teensy Command IDs ===
@@ -29,10 +36,17 @@ CMD_SAVE_SETTINGS = 0x30
 CMD_SOFT_RESET = 0x31
 CMD_SOFT_RESET_SAVE = 0x32
 CMD_ACK = 0x7F
+CMD_ERROR = 0xFE
 CMD_START_STREAM = 0x40
 CMD_STOP_STREAM = 0x41
+CMD_START_AUTOMATION = 0x50
+CMD_STOP_AUTOMATION = 0x51
+CMD_QUEUE_TRAJ_SEG = 0x52
+CMD_GET_TRAJ_STATUS = 0x53
 CMD_SOFT_RELEASE = 0x60
 
+COMMAND_NAMES = {v: k[4:] for k, v in list(globals().items()) if k.startswith("CMD_")}
+
 # === Streaming constants ===
 STREAM_PACKET_MAGIC = 0xA5
 STREAM_TIME_MAGIC = 0xAA
@@ -41,18 +55,227 @@ STREAM_BUFFER_SIZE = 8
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+def parse_status(payload):
+    """Decode the 16-byte GET_STATUS payload into a settings dict."""
+    if len(payload) != 16:
+        raise Exception("[Serial] Invalid status payload length")
+
+    (
+        fw_major,
+        fw_minor,
+        pwm_output_pin,
+        pwm_sensing_pin,
+        current_sensing_pin,
+        pwm_freq,
+        pwm_adc_rate,
+        current_adc_rate,
+        pwm_adc_res,
+        current_adc_res,
+        pwm_depth
+    ) = struct.unpack(">BBBBBIHHBBB", payload)
+
+    return {
+        "firmware_version": f"{fw_major}.{fw_minor}",
+        "pwm_output_pin": pwm_output_pin,
+        "pwm_sensing_pin": pwm_sensing_pin,
+        "current_sensing_pin": current_sensing_pin,
+        "pwm_frequency": pwm_freq,
+        "pwm_adc_rate": pwm_adc_rate,
+        "current_adc_rate": current_adc_rate,
+        "pwm_adc_resolution": pwm_adc_res,
+        "current_adc_resolution": current_adc_res,
+        "pwm_depth": pwm_depth
+    }
+
+
+def parse_traj_state(payload):
+    """
+    Trajectory queue state from a GET_TRAJ_STATUS reply or the tail of a
+    trajectory command ACK (firmware 2.3+). running is None when absent.
+    """
+    if len(payload) < 5:
+        return None
+    free, played = struct.unpack(">BI", payload[:5])
+    running = bool(payload[5]) if len(payload) > 5 else None
+    return {"free": free, "played": played, "running": running}
+
+
+def percent_to_duty(percent, invert=None):
+    """Scale a duty percentage to PWM counts, honouring config.inverting."""
+    from config import inverting, pwm_depth
+    if invert is None:
+        invert = inverting
+    if invert:
+        percent = 100.0 - percent
+    return int(round((percent / 100.0) * pwm_depth))
+
+
+def traj_segment_payload(start_percent, end_percent, duration_ms, shape=1):
+    # Same scaling as SET_DUTY: the ISR writes these values to the pin as is
+    start_val = percent_to_duty(start_percent)
+    end_val = percent_to_duty(end_percent)
+    duration_us = int(round(duration_ms * 1000))
+    return (
+        int(start_val).to_bytes(2, "big") +
+        int(end_val).to_bytes(2, "big") +
+        int(duration_us).to_bytes(2, "big") +
+        bytes([shape])
+    )
+
+
+class CommandBatch:
+    """
+    Collects framed commands and sends them with windowed ACKs.
+    Results are available afterwards as a list of
+    {"cmd": name, "ok": bool, "error": str or None}; if any command
+    failed an exception listing them is raised when the block exits.
+    """
+
+    def __init__(self, controller, window=32, timeout=1.0):
+        self.controller = controller
+        self.window = max(1, window)
+        self.timeout = timeout
+        self.thread = threading.current_thread()
+        self.commands = []  # (cmd_id, payload, expect_ack)
+        self.results = []
+
+    def __enter__(self):
+        if self.controller._batch is not None:
+            raise RuntimeError("Command batches cannot be nested")
+        self.controller._batch = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.controller._batch = None
+        if exc_type is not None:
+            return False
+        self.flush()
+        return False
+
+    def add(self, cmd_id, payload, expect_ack):
+        self.commands.append((cmd_id, payload, expect_ack))
+
+    def flush(self):
+        commands, self.commands = self.commands, []
+        for start in range(0, len(commands), self.window):
+            self._send_window(commands[start:start + self.window])
+
+        failed = [r for r in self.results if not r["ok"]]
+        for r in failed:
+            log.error(f"[Serial] Batched {r['cmd']} failed: {r['error']}")
+        if failed:
+            names = ", ".join(r["cmd"] for r in failed)
+            raise Exception(f"[Serial] {len(failed)} of {len(self.results)} batched commands failed: {names}")
+
+    def _send_window(self, commands):
+        ctrl = self.controller
+        reader = ctrl.reader if ctrl.reader and ctrl.reader.running else None
+
+        expected = []
+        for cmd_id, payload, expect_ack in commands:
+            # Registered in send order, so device errors are charged right
+            if expect_ack:
+                fut = reader.expect(cmd_id) if reader else None
+                expected.append((cmd_id, fut))
+            elif reader:
+                reader.note_unanswered(cmd_id)
+
+        frames = []
+        for cmd_id, payload, _ in commands:
+            full_packet, checksum = ctrl._frame(cmd_id, payload)
+            frames.append(full_packet)
+            log.outgoing(lambda packet: packet.hex(" ").upper(), full_packet)
+        t0 = time.perf_counter()
+        with ctrl.write_lock:
+            ctrl.ser.write(b''.join(frames))
+        log.debug("[Serial] Sent batch of %d commands in one write", len(frames))
+
+        deadline = time.monotonic() + self.timeout
+        if reader:
+            self._collect_futures(expected, deadline, t0)
+        else:
+            self._collect_packets(expected, deadline, t0)
+
+    def _result(self, cmd_id, error=None, reply=None):
+        self.results.append({
+            "cmd": COMMAND_NAMES.get(cmd_id, f"0x{cmd_id:02X}"),
+            "ok": error is None,
+            "error": error,
+            "reply": reply,
+        })
+
+    def _collect_futures(self, expected, deadline, t0):
+        ctrl = self.controller
+        for cmd_id, fut in expected:
+            try:
+                result = fut.result(timeout=max(0, deadline - time.monotonic()))
+                ctrl._check_ack(result, expected_cmd=cmd_id)
+                ctrl._record_latency(cmd_id, time.perf_counter() - t0)
+                self._result(cmd_id, reply=result[1])
+            except FutureTimeoutError:
+                ctrl.reader.cancel(fut)
+                self._result(cmd_id, "no ACK received")
+            except Exception as e:
+                self._result(cmd_id, str(e))
+
+    def _collect_packets(self, expected, deadline, t0):
+        ctrl = self.controller
+        errors = [None] * len(expected)
+        replies = [None] * len(expected)
+        outstanding = list(range(len(expected)))  # indices, oldest first
+        while outstanding and time.monotonic() < deadline:
+            try:
+                result = ctrl.read_packet(timeout=max(0, deadline - time.monotonic()))
+            except Exception as e:
+                # Corrupt frame: charge it to the oldest outstanding command
+                errors[outstanding.pop(0)] = str(e)
+                continue
+            if result is None:
+                break
+            cmd_id, payload = result
+            if cmd_id == CMD_ERROR:
+                # The firmware answers in order and does not echo the command
+                code = payload[0] if payload else 0
+                errors[outstanding.pop(0)] = f"device error 0x{code:02X}"
+            elif cmd_id == CMD_ACK and payload:
+                for i in outstanding:
+                    if expected[i][0] == payload[0]:
+                        outstanding.remove(i)
+                        replies[i] = payload
+                        ctrl._record_latency(payload[0], time.perf_counter() - t0)
+                        break
+        for i in outstanding:
+            errors[i] = "no ACK received"
+        for (cmd_id, _), error, reply in zip(expected, errors, replies):
+            self._result(cmd_id, error, reply)
+
+
 class TeensySolenoidController:
-    def __init__(self, port=None):
+    def __init__(self, port=None, show_status=True):
         self.port = port or serial_port
+        self.show_status = show_status  # drive the Device Status button
         self.baudrate = baudrate
         self.ser = None
         self.is_connected = False
+        self.stream_decoder = StreamDecoder()
+        self.reader = None
+        self.write_lock = threading.Lock()
+        self.latencies = {}  # cmd_id -> recent round-trip times (s)
+        self._batch = None
+        self.capture = None
 
     def close(self):
+        if self.reader:
+            self.reader.stop()
+            self.reader = None
+        self.stop_capture()
         if self.ser and self.ser.is_open:
             self.ser.close()
             log.info("[Serial] Connection closed.")
             self.is_connected = False
+            if not self.show_status:
+                return
 
             dpg.configure_item(STATUS_BUTTON_TAG, label="Unconnected",
                             callback=None, user_data=None)
@@ -62,19 +285,24 @@ class TeensySolenoidController:
 
     def ping(self):
         log.info("[Serial] Pinging device...")
-        self.send_command(CMD_PING)
-        echoed_cmd = self.read_ack(expected_cmd=CMD_PING)
-        # read_ack either raises or returns the echoed command ID
-        if echoed_cmd != CMD_PING:
+        try:
+            return self._ping()
+        except Exception:
             self.close()
+            raise
+
+    def _ping(self):
+        # Leaves the port open on failure, so it can be retried
+        echoed_cmd = self.command_ack(CMD_PING)
+        # command_ack either raises or returns the echoed command ID
+        if echoed_cmd != CMD_PING:
             raise Exception(f"[Serial] No valid response to PING (echoed={echoed_cmd})")
         log.info(f"[Serial] PING ACK received for cmd 0x{echoed_cmd:02X}")
         return True
     
     def stop_pwm(self):
-        self.send_command(CMD_STOP_PWM)
-        echoed_cmd = self.read_ack(expected_cmd=CMD_STOP_PWM)
-        # read_ack either raises or returns the echoed command ID
+        echoed_cmd = self.command_ack(CMD_STOP_PWM)
+        # command_ack either raises or returns the echoed command ID
         if echoed_cmd != CMD_STOP_PWM:
             self.close()
             raise Exception(f"[Serial] No valid response to CMD (echoed={echoed_cmd})")
@@ -82,66 +310,152 @@ class TeensySolenoidController:
         log.info(f"[Serial] PWM Stopped")
         return True
 
-    def connect(self, port=None):
+    def connect(self, port=None, transport=None):
+        """
+        Open the port and wait for the device. transport, if given, is an
+        already open pyserial-like object (e.g. TeensyEmulator.loopback()).
+        """
         if port:
             self.port = port
+        if transport is not None:
+            self.port = self.port or getattr(transport, "port", None)
         if not self.port:
             raise Exception("No serial port specified")
         
         try:
-            dpg.configure_item(STATUS_BUTTON_TAG, label="Connecting...",  
-                               callback=None,  
-                               user_data=None)
-            dpg.bind_item_theme(STATUS_BUTTON_TAG, "status_theme_connecting")
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=1)
-            time.sleep(2)  # Let Teensy settle
-
-            # Drain any garbage before sending commands
-            junk = self.ser.read(self.ser.in_waiting or 1)
-            if junk:
-                log.debug(f"[Serial] Drained pre-connection bytes: {junk.hex(' ')}")
-
-            self.ser.reset_input_buffer()
-
-            self.ping()
+            if self.show_status:
+                dpg.configure_item(STATUS_BUTTON_TAG, label="Connecting...",
+                                   callback=None,
+                                   user_data=None)
+                dpg.bind_item_theme(STATUS_BUTTON_TAG, "status_theme_connecting")
+            if transport is not None:
+                self.ser = transport
+            else:
+                self.ser = serial.Serial(self.port, self.baudrate, timeout=1)
+            if self.capture:
+                self.ser = CaptureTransport(self.ser, self.capture)
+            self._wait_until_ready()
             self.is_connected = True
+
+            # From here on the reader thread owns the receive side
+            self.reader = SerialReader(self.ser)
+            self.reader.start()
             # Finally: show Connected
-            dpg.configure_item(STATUS_BUTTON_TAG, label="Connected",
-                               callback=lambda: on_status_pressed(self),
-                               user_data=self)
-            dpg.bind_item_theme(STATUS_BUTTON_TAG, "status_theme_connected")
+            if self.show_status:
+                dpg.configure_item(STATUS_BUTTON_TAG, label="Connected",
+                                   callback=lambda: on_status_pressed(self),
+                                   user_data=self)
+                dpg.bind_item_theme(STATUS_BUTTON_TAG, "status_theme_connected")
         except Exception as e:
             log.error(f"Failed to connect: {e}")
             self.is_connected = False
             self.close()
             raise
 
+    def start_capture(self, filename):
+        """
+        Record every raw TX/RX chunk to a capture file (see packet_capture.py)
+        until stop_capture() or close(). Works before or after connect().
+        """
+        self.stop_capture()
+        self.capture = PacketCapture(filename)
+        if self.ser is not None:
+            self._set_port(CaptureTransport(self.ser, self.capture))
+        log.info(f"[Serial] Capturing traffic to {filename}")
+        return self.capture
+
+    def stop_capture(self):
+        capture, self.capture = self.capture, None
+        if capture is None:
+            return
+        if isinstance(self.ser, CaptureTransport):
+            self._set_port(self.ser.ser)
+        capture.close()
+        msg = f"[Serial] Capture closed: {capture.records} chunks, {capture.bytes_written} bytes"
+        if capture.dropped:
+            msg += f", {capture.dropped} dropped"
+        log.info(msg)
+
+    def _set_port(self, ser):
+        with self.write_lock:
+            self.ser = ser
+            if self.reader:
+                self.reader.ser = ser
+
+    def _wait_until_ready(self, settle_timeout=2.0):
+        """Ping until the Teensy answers instead of sleeping a fixed time."""
+        deadline = time.monotonic() + settle_timeout
+        backoff = 0.02
+        log.info("[Serial] Pinging device...")
+        while True:
+            # Drain any garbage before sending commands
+            junk = self.ser.read(self.ser.in_waiting)
+            if junk:
+                log.debug(f"[Serial] Drained pre-connection bytes: {junk.hex(' ')}")
+            try:
+                return self._ping()
+            except Exception:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.close()
+                    raise
+            time.sleep(min(backoff, remaining))
+            backoff = min(backoff * 2, 0.2)
+
     def _calculate_checksum(self, data: bytes) -> int:
         return sum(data) & 0xFF
 
-    def send_command(self, cmd_id, payload=b''):
-        if not self.ser or not self.ser.is_open:
-            raise RuntimeError("Serial connection not established.")
-
+    def _frame(self, cmd_id, payload=b''):
         packet = bytes([cmd_id]) + payload
         length = len(packet)  # cmd_id + payload
         checksum = self._calculate_checksum(packet)
-        full_packet = bytes([length]) + packet + bytes([checksum])
-
-        self.ser.write(full_packet)
-        log.debug(f"[Serial] Sent: cmd=0x{cmd_id:02X}, payload={payload.hex()}, checksum=0x{checksum:02X}")
-        log.outgoing(f"{full_packet.hex(' ')}")
-
+        return bytes([length]) + packet + bytes([checksum]), checksum
 
-    def read_packet(self, retries=10, delay=0.01):
-        for _ in range(retries):
-            if self.ser.in_waiting >= 3:
-                break
-            time.sleep(delay)
-        else:
-            return None
+    def send_command(self, cmd_id, payload=b''):
+        if not self.ser or not self.ser.is_open:
+            raise RuntimeError("Serial connection not established.")
 
-        header = self.ser.read(2)
+        batch = self._active_batch()
+        if batch is not None:
+            batch.add(cmd_id, payload, expect_ack=False)
+            return
+
+        if self.reader is not None and self.reader.running:
+            # Nothing waits for a response, but a device error must not be
+            # charged to another request
+            self.reader.note_unanswered(cmd_id)
+        self._write_command(cmd_id, payload)
+
+    def _write_command(self, cmd_id, payload=b''):
+        full_packet, checksum = self._frame(cmd_id, payload)
+        with self.write_lock:
+            self.ser.write(full_packet)
+        log.debug(lambda: f"[Serial] Sent: cmd=0x{cmd_id:02X}, payload={payload.hex()}, checksum=0x{checksum:02X}")
+        log.outgoing(lambda: full_packet.hex(" ").upper())
+
+
+    def _read_exact(self, n, deadline):
+        """Blocking read of n bytes that gives up at the deadline."""
+        data = b''
+        timeout = current = self.ser.timeout
+        try:
+            while len(data) < n:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Setting the timeout reconfigures the port (a syscall), so
+                # only shorten it when it would overrun the deadline by >5 ms
+                if not current or current > remaining + 0.005:
+                    self.ser.timeout = current = remaining
+                data += self.ser.read(n - len(data))
+        finally:
+            if current != timeout:
+                self.ser.timeout = timeout
+        return data
+
+    def read_packet(self, timeout=0.1):
+        deadline = time.monotonic() + timeout
+        header = self._read_exact(2, deadline)
         if len(header) < 2:
             return None
 
@@ -149,12 +463,11 @@ class TeensySolenoidController:
         if length > 64:
             raise Exception(f"[Serial] Invalid length byte: {length}")
 
-        payload = self.ser.read(length - 1)
+        # Payload and checksum arrive together, read them in one go
+        rest = self._read_exact(length, deadline)
+        payload, checksum = rest[:-1], rest[-1:]
         if len(payload) < (length - 1):
             raise Exception("[Serial] Incomplete payload")
-
-        time.sleep(0.005)  # let Teensy catch up
-        checksum = self.ser.read(1)
         if len(checksum) < 1:
             raise Exception(f"[Serial] Missing checksum byte after payload: {payload.hex()}")
 
@@ -162,16 +475,18 @@ class TeensySolenoidController:
         if self._calculate_checksum(data) != checksum[0]:
             raise Exception("[Serial] Checksum mismatch")
 
-        log.debug(f"[Serial] Received: cmd=0x{cmd_id:02X}, payload={payload.hex()}, checksum=0x{checksum[0]:02X}")
-        full = bytes([length, cmd_id]) + payload + checksum
-        log.incoming(" ".join(f"{b:02X}" for b in full))
+        log.debug(lambda: f"[Serial] Received: cmd=0x{cmd_id:02X}, payload={payload.hex()}, checksum=0x{checksum[0]:02X}")
+        if log.enabled("incoming"):
+            full = bytes([length, cmd_id]) + payload + checksum
+            log.incoming(lambda: full.hex(" ").upper())
         
         return cmd_id, payload
 
 
     def read_ack(self, expected_cmd=None):
+        return self._check_ack(self.read_packet(), expected_cmd)
 
-        result = self.read_packet()
+    def _check_ack(self, result, expected_cmd=None):
         if result is None:
             raise Exception("[Serial] No ACK received")
 
@@ -191,6 +506,89 @@ class TeensySolenoidController:
 
         return echoed_cmd
 
+    def transact(self, cmd_id, payload=b'', timeout=1.0):
+        """
+        Send a command and wait for its response (the ACK echoing cmd_id, a
+        reply carrying cmd_id, or a device error).
+        Returns (cmd_id, payload) of the response, or None on timeout when
+        the reader thread is not running.
+        """
+        if self._active_batch() is not None:
+            raise RuntimeError("Commands with a reply cannot be issued inside batch()")
+
+        t0 = time.perf_counter()
+        if self.reader is None or not self.reader.running:
+            self.send_command(cmd_id, payload)
+            result = self.read_packet(timeout=timeout)
+        else:
+            if not self.ser or not self.ser.is_open:
+                raise RuntimeError("Serial connection not established.")
+            fut = self.reader.expect(cmd_id)
+            try:
+                self._write_command(cmd_id, payload)
+                result = fut.result(timeout=timeout)
+            except FutureTimeoutError:
+                raise Exception(f"[Serial] No response to cmd 0x{cmd_id:02X}")
+            finally:
+                self.reader.cancel(fut)
+        if result is not None:
+            self._record_latency(cmd_id, time.perf_counter() - t0)
+        return result
+
+    def _record_latency(self, cmd_id, elapsed):
+        samples = self.latencies.get(cmd_id)
+        if samples is None:
+            samples = self.latencies[cmd_id] = deque(maxlen=256)
+        samples.append(elapsed)
+        log.debug("[Serial] cmd=0x%02X round trip %.2f ms", cmd_id, elapsed * 1000)
+
+    def latency_stats(self):
+        """
+        Round-trip latency per command over the last 256 requests, in ms.
+        Returns {name: {"count", "mean", "min", "max", "last"}}.
+        """
+        stats = {}
+        for cmd_id, samples in list(self.latencies.items()):
+            values = list(samples)
+            if not values:
+                continue
+            stats[COMMAND_NAMES.get(cmd_id, f"0x{cmd_id:02X}")] = {
+                "count": len(values),
+                "mean": 1000 * sum(values) / len(values),
+                "min": 1000 * min(values),
+                "max": 1000 * max(values),
+                "last": 1000 * values[-1],
+            }
+        return stats
+
+    def command_ack(self, cmd_id, payload=b''):
+        """Send a command and wait for its ACK (queued instead inside batch())."""
+        batch = self._active_batch()
+        if batch is not None:
+            batch.add(cmd_id, payload, expect_ack=True)
+            return cmd_id
+        return self._check_ack(self.transact(cmd_id, payload), expected_cmd=cmd_id)
+
+    def batch(self, window=32, timeout=1.0):
+        """
+        Pipeline several commands into one round trip:
+
+            with controller.batch() as b:
+                controller.set_pwm_frequency(20000)
+                controller.set_current_adc_rate(20000)
+                controller.save_settings()
+
+        Commands issued from this thread inside the block are framed and
+        written together when it exits; ACKs are matched by echoed command id.
+        """
+        return CommandBatch(self, window=window, timeout=timeout)
+
+    def _active_batch(self):
+        batch = self._batch
+        if batch is not None and batch.thread is threading.current_thread():
+            return batch
+        return None
+
     def log_status_fields(self, payload):
         try:
             if len(payload) != 16:
@@ -226,115 +624,79 @@ class TeensySolenoidController:
             log.info(f"[Status] Failed to parse payload: {e}")
 
     def get_status(self):
-        self.send_command(CMD_GET_STATUS)
-        result = self.read_packet()
+        result = self.transact(CMD_GET_STATUS)
         if not result or result[0] != CMD_GET_STATUS:
             raise Exception("[Serial] Invalid status response")
 
         payload = result[1]
         self.log_status_fields(payload)
-        if len(payload) != 16:
-            raise Exception("[Serial] Invalid status payload length")
-
-        (
-            fw_major,
-            fw_minor,
-            pwm_output_pin,
-            pwm_sensing_pin,
-            current_sensing_pin,
-            pwm_freq,
-            pwm_adc_rate,
-            current_adc_rate,
-            pwm_adc_res,
-            current_adc_res,
-            pwm_depth
-        ) = struct.unpack(">BBBBBIHHBBB", payload)
-
-        return {
-            "firmware_version": f"{fw_major}.{fw_minor}",
-            "pwm_output_pin": pwm_output_pin,
-            "pwm_sensing_pin": pwm_sensing_pin,
-            "current_sensing_pin": current_sensing_pin,
-            "pwm_frequency": pwm_freq,
-            "pwm_adc_rate": pwm_adc_rate,
-            "current_adc_rate": current_adc_rate,
-            "pwm_adc_resolution": pwm_adc_res,
-            "current_adc_resolution": current_adc_res,
-            "pwm_depth": pwm_depth
-        }
+        return parse_status(payload)
 
     def get_duty(self):
-        self.send_command(CMD_GET_DUTY)
-        result = self.read_packet()
+        result = self.transact(CMD_GET_DUTY)
         if not result or result[0] != CMD_GET_DUTY or len(result[1]) != 2:
             raise Exception("[Serial] Invalid duty response")
         return struct.unpack(">H", result[1])[0]
 
     def set_pwm_frequency(self, frequency_hz):
         frequency_hz = int(frequency_hz)
-        self.send_command(CMD_SET_PWM_FREQ, struct.pack(">I", frequency_hz))
-        self.read_ack(expected_cmd=CMD_SET_PWM_FREQ)
+        self.command_ack(CMD_SET_PWM_FREQ, struct.pack(">I", frequency_hz))
 
     def set_pwm_output_pin(self, pin):
-        self.send_command(CMD_SET_PWM_OUTPUT_PIN, struct.pack("B", pin))
-        self.read_ack(expected_cmd=CMD_SET_PWM_OUTPUT_PIN)
+        self.command_ack(CMD_SET_PWM_OUTPUT_PIN, struct.pack("B", pin))
 
     def set_pwm_sensing_pin(self, pin):
-        self.send_command(CMD_SET_PWM_SENSING_PIN, struct.pack("B", pin))
-        self.read_ack(expected_cmd=CMD_SET_PWM_SENSING_PIN)
+        self.command_ack(CMD_SET_PWM_SENSING_PIN, struct.pack("B", pin))
 
     def set_current_sensing_pin(self, pin):
-        self.send_command(CMD_SET_CURRENT_SENSING_PIN, struct.pack("B", pin))
-        self.read_ack(expected_cmd=CMD_SET_CURRENT_SENSING_PIN)
+        self.command_ack(CMD_SET_CURRENT_SENSING_PIN, struct.pack("B", pin))
 
     def set_pwm_adc_rate(self, rate_hz):
-        self.send_command(CMD_SET_PWM_ADC_RATE, struct.pack(">H", rate_hz))
-        self.read_ack(expected_cmd=CMD_SET_PWM_ADC_RATE)
+        self.command_ack(CMD_SET_PWM_ADC_RATE, struct.pack(">H", rate_hz))
 
     def set_current_adc_rate(self, rate_hz):
-        self.send_command(CMD_SET_CURRENT_ADC_RATE, struct.pack(">H", rate_hz))
-        self.read_ack(expected_cmd=CMD_SET_CURRENT_ADC_RATE)
+        self.command_ack(CMD_SET_CURRENT_ADC_RATE, struct.pack(">H", rate_hz))
 
     def set_pwm_adc_resolution(self, bits):
-        self.send_command(CMD_SET_PWM_ADC_RES, struct.pack("B", bits))
-        self.read_ack(expected_cmd=CMD_SET_PWM_ADC_RES)
+        self.command_ack(CMD_SET_PWM_ADC_RES, struct.pack("B", bits))
 
     def set_current_adc_resolution(self, bits):
-        self.send_command(CMD_SET_CURRENT_ADC_RES, struct.pack("B", bits))
-        self.read_ack(expected_cmd=CMD_SET_CURRENT_ADC_RES)
+        self.command_ack(CMD_SET_CURRENT_ADC_RES, struct.pack("B", bits))
 
     def set_pwm_depth(self, bits):
-        self.send_command(CMD_SET_PWM_DEPTH, struct.pack("B", bits))
-        self.read_ack(expected_cmd=CMD_SET_PWM_DEPTH)
+        self.command_ack(CMD_SET_PWM_DEPTH, struct.pack("B", bits))
 
     def set_duty(self, duty):
         self.send_command(CMD_SET_DUTY, struct.pack(">H", duty))
 
     def set_duty_ack(self, duty):
-        self.send_command(CMD_SET_DUTY_ACK, struct.pack(">H", duty))
-        self.read_ack(expected_cmd=CMD_SET_DUTY_ACK)
+        self.command_ack(CMD_SET_DUTY_ACK, struct.pack(">H", duty))
 
     def set_duty_fast(self, duty):
         self.send_command(CMD_SET_DUTY_FAST, struct.pack(">H", duty))
 
     def save_settings(self):
-        self.send_command(CMD_SAVE_SETTINGS)
-        self.read_ack(expected_cmd=CMD_SAVE_SETTINGS)
+        self.command_ack(CMD_SAVE_SETTINGS)
 
     def soft_reset(self):
         self.send_command(CMD_SOFT_RESET)
 
     def soft_reset_and_save(self):
-        self.send_command(CMD_SOFT_RESET_SAVE)
-        self.read_ack(expected_cmd=CMD_SOFT_RESET_SAVE)
+        self.command_ack(CMD_SOFT_RESET_SAVE)
 
     def start_streaming(self):
         """Send command to start streaming."""
-        self.send_command(CMD_START_STREAM)
-        self.read_ack(expected_cmd=CMD_START_STREAM)
+        self.stream_decoder.reset()
+        if self.reader:
+            self.reader.reset_stream()
+        self.command_ack(CMD_START_STREAM)
 
     def stop_streaming(self):
         """Send command to stop streaming."""
+        if self.reader and self.reader.running:
+            # The reader demultiplexes the ACK from in-flight stream data
+            self.command_ack(CMD_STOP_STREAM)
+            return
         self.send_command(CMD_STOP_STREAM)
         # Flush serial buffer before reading ACK
         if self.ser:
@@ -401,50 +763,80 @@ class TeensySolenoidController:
                 continue
 
 
+    def read_stream_packets(self, timeout=1.0):
+        """
+        Drain everything waiting on the serial port and decode it in bulk.
+        Returns the StreamDecoder batch dict (duty, current, flags, time),
+        or None if nothing arrived before the timeout.
+        """
+        if self.reader and self.reader.running:
+            return self.reader.get_stream_batch(timeout=timeout)
+
+        start_time = time.time()
+        while self.ser.in_waiting < 1:
+            if (time.time() - start_time) > timeout:
+                return None
+            time.sleep(0.001)
+
+        crc_errors = self.stream_decoder.crc_errors
+        batch = self.stream_decoder.feed(self.ser.read(self.ser.in_waiting))
+        if self.stream_decoder.crc_errors != crc_errors:
+            logger.warning(f"[Stream] CRC mismatch in {self.stream_decoder.crc_errors - crc_errors} packet(s)")
+        return batch
+
     def _compute_crc8(self, data):
-        crc = 0x00
-        for b in data:
-            for _ in range(8):
-                mix = (crc ^ b) & 0x01
-                crc >>= 1
-                if mix:
-                    crc ^= 0x8C
-                b >>= 1
-        return crc
+        return crc8(data)
 
     def send_duty(self, percent):
-        from config import inverting, pwm_depth
-        if inverting:
-            percent = 100.0 - percent
-        scaled = int(round((percent / 100.0) * pwm_depth))
-        self.set_duty(scaled)
+        self.set_duty(percent_to_duty(percent))
 
     def send_duty_fast(self, percent):
-        from config import inverting, pwm_depth
-        if inverting:
-            percent = 100.0 - percent
-        scaled = int(round((percent / 100.0) * pwm_depth))
-        self.set_duty_fast(scaled)
+        self.set_duty_fast(percent_to_duty(percent))
 
     def queue_traj_segment(self, start_percent, end_percent, duration_ms, shape=1):
-        from config import pwm_depth
-        start_val = int(round((start_percent / 100.0) * pwm_depth))
-        end_val = int(round((end_percent / 100.0) * pwm_depth))
-        duration_us = int(duration_ms * 1000)
-        payload = (
-            int(start_val).to_bytes(2, "big") +
-            int(end_val).to_bytes(2, "big") +
-            int(duration_us).to_bytes(2, "big") +
-            bytes([shape])
-        )
-        self.send_command(0x52, payload)
+        payload = traj_segment_payload(start_percent, end_percent, duration_ms, shape)
+        self.send_command(CMD_QUEUE_TRAJ_SEG, payload)
+
+    def _traj_command(self, cmd_id, payload=b''):
+        # Firmware 2.3+ ACKs carry the queue state; inside batch() it is
+        # in the batch results ("reply") instead
+        if self._active_batch() is not None:
+            self.command_ack(cmd_id, payload)
+            return None
+        result = self.transact(cmd_id, payload)
+        self._check_ack(result, expected_cmd=cmd_id)
+        return parse_traj_state(result[1][1:])
+
+    def queue_traj_segment_ack(self, start_percent, end_percent, duration_ms, shape=1):
+        """
+        Firmware 2.3+: ACKed with the queue state, and refused with
+        ERR_QUEUE_FULL instead of overwriting unplayed segments.
+        """
+        payload = traj_segment_payload(start_percent, end_percent, duration_ms, shape)
+        return self._traj_command(CMD_QUEUE_TRAJ_SEG, payload)
+
+    def get_traj_status(self):
+        """Firmware 2.3+: {"free", "played", "running"} of the trajectory queue."""
+        result = self.transact(CMD_GET_TRAJ_STATUS)
+        if not result or result[0] != CMD_GET_TRAJ_STATUS:
+            raise Exception("[Serial] Invalid trajectory status response")
+        return parse_traj_state(result[1])
 
     def start_automation(self):
-        self.send_command(0x50)
+        self.send_command(CMD_START_AUTOMATION)
+
+    def start_automation_ack(self):
+        return self._traj_command(CMD_START_AUTOMATION)
+
+    def stop_automation(self):
+        self.send_command(CMD_STOP_AUTOMATION)
+
+    def stop_automation_ack(self):
+        """Firmware 2.3+: also clears the queue and the started-segment count."""
+        return self._traj_command(CMD_STOP_AUTOMATION)
 
     def send_soft_release(self, start_percent, n_steps, freq_hz, power_index):
-        from config import pwm_depth
-        start_val = int(round((start_percent / 100.0) * pwm_depth))
+        start_val = percent_to_duty(start_percent, invert=False)
         payload = (
             int(start_val).to_bytes(2, "big") +
             int(n_steps).to_bytes(2, "big") +
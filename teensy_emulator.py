@@ -0,0 +1,554 @@
+# === teensy_emulator.py ===
+# Software model of the SolenoidController 2.x firmware for hardware-free
+# testing and benchmarking of the host stack.
+#
+#   emu = TeensyEmulator(adc_rate=50000)
+#   controller.connect(transport=emu.loopback())   # in-process
+#   controller.connect(emu.open_pty())             # or through a pty (POSIX)
+#
+# Wire-visible quirks of firmware 2.2 are reproduced on purpose:
+#   - QUEUE_TRAJ_SEG falls through into SAVE_SETTINGS and is answered with an
+#     ACK echoing 0x30
+#   - START_AUTOMATION empties the trajectory queue before starting, and a
+#     step segment never advances
+#   - the GET_DUTY reply has no length byte
+#   - SOFT_RELEASE is not implemented and answers ERR_UNKNOWN_COMMAND
+#   - GET_STATUS reports version 2.1, as the 2.2 build does
+# With firmware=(2, 3) the trajectory commands behave like
+# SolenoidController2.3.c instead: segments queued before START_AUTOMATION
+# are played, step segments hold for their duration, the automation and
+# queue commands are ACKed with their own ID and a full queue answers
+# ERR_QUEUE_FULL; those ACKs and GET_TRAJ_STATUS report the free queue
+# slots, segments started and whether automation is running, for
+# credit-based flow control.
+# All host setters are ACKed (2.2 only implements some of them), so the
+# host side can be exercised end to end.
+import os
+import random
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from crc8 import crc8, crc8_frames
+
+CMD_PING = 0x01
+CMD_GET_STATUS = 0x02
+CMD_GET_DUTY = 0x03
+CMD_STOP_PWM = 0x09
+CMD_SET_PWM_OUTPUT_PIN = 0x10
+CMD_SET_PWM_SENSING_PIN = 0x11
+CMD_SET_CURRENT_SENSING_PIN = 0x12
+CMD_SET_PWM_FREQ = 0x13
+CMD_SET_PWM_ADC_RATE = 0x14
+CMD_SET_CURRENT_ADC_RATE = 0x15
+CMD_SET_PWM_ADC_RES = 0x16
+CMD_SET_CURRENT_ADC_RES = 0x17
+CMD_SET_PWM_DEPTH = 0x18
+CMD_SET_DUTY_ACK = 0x19
+CMD_SET_DUTY = 0x20
+CMD_SET_DUTY_FAST = 0x21
+CMD_SAVE_SETTINGS = 0x30
+CMD_SOFT_RESET = 0x31
+CMD_SOFT_RESET_SAVE = 0x32
+CMD_START_STREAM = 0x40
+CMD_STOP_STREAM = 0x41
+CMD_START_AUTOMATION = 0x50
+CMD_STOP_AUTOMATION = 0x51
+CMD_QUEUE_TRAJ_SEG = 0x52
+CMD_GET_TRAJ_STATUS = 0x53
+CMD_ACK = 0x7F
+CMD_ERROR = 0xFE
+
+ERR_INVALID_PAYLOAD = 0xE1
+ERR_INVALID_DUTY = 0xE2
+ERR_UNKNOWN_COMMAND = 0xE3
+ERR_QUEUE_FULL = 0xE4
+
+STREAM_PACKET_MAGIC = 0xA5
+STREAM_TIME_MAGIC = 0xAA
+STREAM_BUFFER_SIZE = 8
+TRAJ_BUFFER_SIZE = 16
+MAX_PACKET_SIZE = 64
+TIME_SYNC_INTERVAL_US = 500000
+
+# Version reported by GET_STATUS where the build's defines lag its file name
+# (SolenoidController2.2.c still says 2.1)
+REPORTED_VERSIONS = {(2, 2): (2, 1)}
+
+
+def default_settings():
+    return {
+        "pwm_output_pin": 5,
+        "pwm_sensing_pin": 20,     # A6
+        "current_sensing_pin": 14,  # A0
+        "pwm_frequency": 10000,
+        "pwm_adc_rate": 10000,
+        "current_adc_rate": 10000,
+        "pwm_adc_resolution": 10,
+        "current_adc_resolution": 10,
+        "pwm_depth": 10,
+    }
+
+
+class TeensyEmulator:
+    """
+    Emulated device. Host bytes go in through receive(); device bytes come
+    out through the attached transport.
+
+    adc_rate overrides the configured current_adc_rate for streaming (the
+    firmware field is 16 bit, so rates above 65535 Hz need the override).
+    corrupt_rate is the probability of flipping one bit in each emitted byte;
+    jitter is the maximum extra delay, in seconds, added to each stream tick.
+    """
+
+    def __init__(self, adc_rate=None, corrupt_rate=0.0, jitter=0.0, tick=0.001,
+                 micros_start=0, firmware=(2, 2), seed=None):
+        self.cfg = default_settings()
+        self.adc_rate = adc_rate
+        self.corrupt_rate = corrupt_rate
+        self.jitter = jitter
+        self.tick = tick
+        self.micros_start = micros_start
+        self.firmware = firmware
+        self.rng = np.random.default_rng(seed)
+        self.random = random.Random(seed)
+
+        self.lock = threading.RLock()
+        self.rx = bytearray()
+        self.output = None  # callable(bytes), set by the transport
+        self.t0 = time.perf_counter()
+
+        self.current_duty = (1 << self.cfg["pwm_depth"]) - 1
+        self.stream_enabled = False
+        self.automation_enabled = False
+        self.traj_queue = deque()
+        self.traj_overruns = 0
+        self.traj_played = 0
+        self.segment = None  # [start, end, steps, index, shape]
+        # Control ISR clock: trajectories advance on it whether or not the
+        # stream is on, and the stream samples the duty of each tick
+        self.isr_rate = None
+        self.isr_t0 = 0.0
+        self.isr_ticks = 0
+        self.stream_pending = np.empty(0, dtype=np.uint16)
+
+        self.stats = {"commands": 0, "packets": 0, "samples": 0, "bytes_out": 0,
+                      "corrupted": 0}
+        self.running = True
+        self.stream_thread = threading.Thread(target=self._stream_loop, daemon=True)
+        self.stream_thread.start()
+        self.pty_thread = None
+        self.master_fd = None
+
+    # === Transports ===
+
+    def loopback(self):
+        """In-process pyserial-like transport connected to this emulator."""
+        transport = LoopbackSerial(self)
+        self.output = transport._deliver
+        return transport
+
+    def open_pty(self):
+        """Expose the emulator on a pseudo terminal and return its path."""
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        tty.setraw(master)
+        self.master_fd = master
+        self.slave_fd = slave
+        self.output = self._write_pty
+        self.pty_thread = threading.Thread(target=self._pty_loop, daemon=True)
+        self.pty_thread.start()
+        return os.ttyname(slave)
+
+    def _write_pty(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.write(self.master_fd, view)
+            view = view[written:]
+
+    def _pty_loop(self):
+        while self.running:
+            try:
+                data = os.read(self.master_fd, 4096)
+            except OSError:
+                break
+            if data:
+                self.receive(data)
+
+    def close(self):
+        self.running = False
+        if self.master_fd is not None:
+            os.close(self.master_fd)
+            os.close(self.slave_fd)
+            self.master_fd = None
+
+    def micros(self):
+        elapsed = int((time.perf_counter() - self.t0) * 1e6)
+        return (self.micros_start + elapsed) & 0xFFFFFFFF
+
+    def _emit(self, data):
+        if self.corrupt_rate > 0:
+            data = self._corrupt(data)
+        self.stats["bytes_out"] += len(data)
+        if self.output is not None:
+            self.output(bytes(data))
+
+    def _corrupt(self, data):
+        buf = np.frombuffer(bytes(data), dtype=np.uint8).copy()
+        hits = np.nonzero(self.rng.random(len(buf)) < self.corrupt_rate)[0]
+        if len(hits):
+            buf[hits] ^= (1 << self.rng.integers(0, 8, len(hits))).astype(np.uint8)
+            self.stats["corrupted"] += len(hits)
+        return buf.tobytes()
+
+    # === Command handling ===
+
+    def receive(self, data):
+        with self.lock:
+            self.rx += data
+            while self.rx:
+                length = self.rx[0]
+                if length < 1 or length > MAX_PACKET_SIZE - 2:
+                    # invalid, discard and resync
+                    del self.rx[0]
+                    continue
+                if len(self.rx) < length + 2:
+                    return
+                packet = bytes(self.rx[1:1 + length])
+                checksum = self.rx[1 + length]
+                del self.rx[:length + 2]
+                if sum(packet) & 0xFF == checksum:
+                    self.stats["commands"] += 1
+                    self._handle(packet[0], packet[1:])
+                else:
+                    self._send_error(ERR_INVALID_PAYLOAD)
+
+    def _send_packet(self, cmd_id, payload=b''):
+        body = bytes([cmd_id]) + payload
+        self._emit(bytes([len(body)]) + body + bytes([sum(body) & 0xFF]))
+
+    def _send_ack(self, cmd):
+        self._send_packet(CMD_ACK, bytes([cmd]))
+
+    def _traj_state(self):
+        free = TRAJ_BUFFER_SIZE - 1 - len(self.traj_queue)
+        return struct.pack(">BIB", free, self.traj_played & 0xFFFFFFFF, int(self.automation_enabled))
+
+    def _send_traj_ack(self, cmd):
+        self._send_packet(CMD_ACK, bytes([cmd]) + self._traj_state())
+
+    def _send_error(self, code):
+        self._send_packet(CMD_ERROR, bytes([code]))
+
+    def _handle(self, cmd, p):
+        cfg = self.cfg
+        setters = {
+            CMD_SET_PWM_OUTPUT_PIN: ("pwm_output_pin", "B"),
+            CMD_SET_PWM_SENSING_PIN: ("pwm_sensing_pin", "B"),
+            CMD_SET_CURRENT_SENSING_PIN: ("current_sensing_pin", "B"),
+            CMD_SET_PWM_ADC_RATE: ("pwm_adc_rate", ">H"),
+            CMD_SET_CURRENT_ADC_RATE: ("current_adc_rate", ">H"),
+            CMD_SET_PWM_ADC_RES: ("pwm_adc_resolution", "B"),
+            CMD_SET_CURRENT_ADC_RES: ("current_adc_resolution", "B"),
+            CMD_SET_PWM_DEPTH: ("pwm_depth", "B"),
+        }
+        if cmd == CMD_PING:
+            self._send_ack(CMD_PING)
+        elif cmd == CMD_GET_STATUS:
+            major, minor = REPORTED_VERSIONS.get(self.firmware, self.firmware)
+            payload = struct.pack(
+                ">BBBBBIHHBBB", major, minor,
+                cfg["pwm_output_pin"], cfg["pwm_sensing_pin"], cfg["current_sensing_pin"],
+                cfg["pwm_frequency"], cfg["pwm_adc_rate"], cfg["current_adc_rate"],
+                cfg["pwm_adc_resolution"], cfg["current_adc_resolution"], cfg["pwm_depth"])
+            self._send_packet(CMD_GET_STATUS, payload)
+        elif cmd == CMD_GET_DUTY:
+            resp = bytes([CMD_GET_DUTY, self.current_duty >> 8, self.current_duty & 0xFF])
+            self._emit(resp + bytes([sum(resp) & 0xFF]))
+        elif cmd in setters:
+            key, fmt = setters[cmd]
+            if len(p) == struct.calcsize(fmt):
+                cfg[key] = struct.unpack(fmt, p)[0]
+                self._send_ack(cmd)
+            else:
+                self._send_error(ERR_INVALID_PAYLOAD)
+        elif cmd == CMD_SET_PWM_FREQ:
+            if len(p) == 4:
+                cfg["pwm_frequency"] = min(100000, max(1000, struct.unpack(">I", p)[0]))
+                self._send_ack(cmd)
+            else:
+                self._send_error(ERR_INVALID_PAYLOAD)
+        elif cmd in (CMD_SET_DUTY, CMD_SET_DUTY_ACK):
+            if len(p) == 2:
+                d = struct.unpack(">H", p)[0]
+                if d > (1 << cfg["pwm_depth"]) - 1:
+                    self._send_error(ERR_INVALID_DUTY)
+                else:
+                    self.current_duty = d
+                    if cmd == CMD_SET_DUTY_ACK:
+                        self._send_ack(cmd)
+            else:
+                self._send_error(ERR_INVALID_PAYLOAD)
+        elif cmd == CMD_SET_DUTY_FAST:
+            if len(p) == 2:
+                self.current_duty = struct.unpack(">H", p)[0]
+        elif cmd == CMD_STOP_PWM:
+            self.current_duty = (1 << cfg["pwm_depth"]) - 1
+            self._send_ack(cmd)
+        elif cmd == CMD_START_STREAM:
+            self._start_stream()
+            self._send_ack(cmd)
+        elif cmd == CMD_STOP_STREAM:
+            self.stream_enabled = False
+            self._send_ack(cmd)
+        elif cmd == CMD_START_AUTOMATION and self.firmware >= (2, 3):
+            if not self.automation_enabled:
+                self.automation_enabled = True
+                self._next_segment()
+            self._send_traj_ack(cmd)
+        elif cmd == CMD_STOP_AUTOMATION and self.firmware >= (2, 3):
+            self.automation_enabled = False
+            self.traj_queue.clear()
+            self.segment = None
+            self.traj_played = 0
+            self._send_traj_ack(cmd)
+        elif cmd == CMD_GET_TRAJ_STATUS and self.firmware >= (2, 3):
+            self._send_packet(CMD_GET_TRAJ_STATUS, self._traj_state())
+        elif cmd == CMD_QUEUE_TRAJ_SEG and self.firmware >= (2, 3):
+            if len(p) != 7:
+                self._send_error(ERR_INVALID_PAYLOAD)
+            elif len(self.traj_queue) >= TRAJ_BUFFER_SIZE - 1:
+                self._send_error(ERR_QUEUE_FULL)
+            else:
+                self.traj_queue.append(struct.unpack(">HHHB", p))
+                self._send_traj_ack(cmd)
+        elif cmd == CMD_START_AUTOMATION:
+            self.traj_queue.clear()
+            self.automation_enabled = True
+            self.segment = None
+            self._next_segment()
+        elif cmd == CMD_STOP_AUTOMATION:
+            self.automation_enabled = False
+        elif cmd == CMD_QUEUE_TRAJ_SEG:
+            if len(p) >= 7:
+                start, end, duration_us, shape = struct.unpack(">HHHB", p[:7])
+                if len(self.traj_queue) >= TRAJ_BUFFER_SIZE:
+                    # The firmware ring silently overwrites unplayed segments
+                    self.traj_queue.popleft()
+                    self.traj_overruns += 1
+                self.traj_queue.append((start, end, duration_us, shape))
+            # Falls through into SAVE_SETTINGS like firmware 2.2
+            self._send_ack(CMD_SAVE_SETTINGS)
+        elif cmd == CMD_SAVE_SETTINGS:
+            self._send_ack(cmd)
+        elif cmd == CMD_SOFT_RESET:
+            self._reset()
+        elif cmd == CMD_SOFT_RESET_SAVE:
+            self._send_ack(cmd)
+            self._reset()
+        else:
+            self._send_error(ERR_UNKNOWN_COMMAND)
+
+    def _reset(self):
+        self.stream_enabled = False
+        self.automation_enabled = False
+        self.traj_queue.clear()
+        self.segment = None
+        self.cfg = default_settings()
+        self.current_duty = (1 << self.cfg["pwm_depth"]) - 1
+
+    # === Trajectory playback ===
+
+    def _next_segment(self):
+        if not self.traj_queue:
+            self.automation_enabled = False
+            self.segment = None
+            return
+        start, end, duration_us, shape = self.traj_queue.popleft()
+        self.traj_played += 1
+        steps = max(1, duration_us // max(1, 1000000 // int(self._rate())))
+        self.segment = [start, end, steps, 0, shape]
+
+    def _duty_block(self, n):
+        """Duty values for the next n ADC ticks."""
+        if not self.automation_enabled:
+            return np.full(n, self.current_duty, dtype=np.uint16)
+
+        out = np.empty(n, dtype=np.uint16)
+        filled = 0
+        while filled < n:
+            if self.segment is None:
+                out[filled:] = self.current_duty
+                break
+            start, end, steps, index, shape = self.segment
+            if shape == 0 and self.firmware < (2, 3):
+                # 2.2 never advances past a step segment
+                out[filled:] = end
+                self.current_duty = end
+                break
+            count = min(n - filled, steps - index)
+            k = np.arange(index + 1, index + count + 1)
+            if shape == 0:
+                out[filled:filled + count] = end
+            else:
+                # Truncate toward zero like the firmware's int32 division
+                delta = (end - start) * k
+                out[filled:filled + count] = start + np.sign(delta) * (np.abs(delta) // steps)
+            filled += count
+            self.segment[3] += count
+            self.current_duty = int(out[filled - 1])
+            if self.segment[3] >= steps:
+                self._next_segment()
+        return out
+
+    # === Streaming ===
+
+    def _rate(self):
+        return self.adc_rate or self.cfg["current_adc_rate"]
+
+    def _start_stream(self):
+        self.stream_enabled = True
+        self.stream_pending = np.empty(0, dtype=np.uint16)
+        self.last_sync = self.micros()
+
+    def _stream_loop(self):
+        while self.running:
+            delay = self.tick
+            if self.jitter:
+                delay += self.random.uniform(0, self.jitter)
+            time.sleep(delay)
+            with self.lock:
+                duty = self._run_isr()
+                if self.stream_enabled and duty is not None:
+                    self._stream_tick(duty)
+
+    def _run_isr(self):
+        """Run the control ISR up to now; returns the duty of each tick, or None."""
+        rate = self._rate()
+        now = time.perf_counter()
+        if rate != self.isr_rate:
+            # First run or the ADC rate changed: restart the clock
+            self.isr_rate, self.isr_t0, self.isr_ticks = rate, now, 0
+        n = int((now - self.isr_t0) * rate) - self.isr_ticks
+        if n <= 0:
+            return None
+        self.isr_ticks += n
+        if not (self.stream_enabled or self.automation_enabled):
+            return None
+        return self._duty_block(n)
+
+    def _stream_tick(self, duty):
+        # Emit whole packets only, like the firmware's 8-sample buffer
+        duty = np.concatenate((self.stream_pending, duty))
+        n = len(duty) - len(duty) % STREAM_BUFFER_SIZE
+        self.stream_pending = duty[n:]
+        if n == 0:
+            return
+        duty = duty[:n]
+        full_scale = (1 << self.cfg["current_adc_resolution"]) - 1
+        depth_scale = (1 << self.cfg["pwm_depth"]) - 1
+        current = duty.astype(np.float64) * (full_scale / depth_scale) * 0.8
+        current += self.rng.normal(0, 2.0, n)
+        current = np.clip(current, 0, full_scale).astype(np.uint16)
+
+        packets = n // STREAM_BUFFER_SIZE
+        frames = np.empty((packets, 2 + 4 * STREAM_BUFFER_SIZE + 1), dtype=np.uint8)
+        frames[:, 0] = STREAM_PACKET_MAGIC
+        frames[:, 1] = 0
+        samples = np.empty((n, 2), dtype="<u2")
+        samples[:, 0] = duty
+        samples[:, 1] = current
+        frames[:, 2:-1] = samples.view(np.uint8).reshape(packets, -1)
+        frames[:, -1] = crc8_frames(frames[:, 1:-1])
+        out = frames.tobytes()
+
+        now = self.micros()
+        if (now - self.last_sync) & 0xFFFFFFFF >= TIME_SYNC_INTERVAL_US:
+            body = bytes([0x01]) + now.to_bytes(4, "big")
+            out += bytes([STREAM_TIME_MAGIC]) + body + bytes([crc8(body)])
+            self.last_sync = now
+
+        self.stats["packets"] += packets
+        self.stats["samples"] += n
+        self._emit(out)
+
+
+class LoopbackSerial:
+    """Minimal pyserial Serial look-alike wired straight to an emulator."""
+
+    def __init__(self, emulator, timeout=1):
+        self.emulator = emulator
+        self.timeout = timeout
+        self.port = "loop://teensy-emulator"
+        self.buffer = bytearray()
+        self.cv = threading.Condition()
+        self.is_open = True
+
+    def _deliver(self, data):
+        with self.cv:
+            self.buffer += data
+            self.cv.notify_all()
+
+    @property
+    def in_waiting(self):
+        with self.cv:
+            return len(self.buffer)
+
+    def read(self, size=1):
+        with self.cv:
+            if self.timeout is None:
+                self.cv.wait_for(lambda: len(self.buffer) >= size or not self.is_open)
+            elif self.timeout > 0:
+                self.cv.wait_for(lambda: len(self.buffer) >= size or not self.is_open,
+                                 timeout=self.timeout)
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+
+    def write(self, data):
+        if not self.is_open:
+            raise OSError("Loopback port is closed")
+        self.emulator.receive(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self.cv:
+            self.buffer.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        with self.cv:
+            self.is_open = False
+            self.cv.notify_all()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Emulate a SolenoidController on a pseudo terminal")
+    parser.add_argument("--rate", type=int, default=None, help="ADC/stream rate in Hz")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="bit flip probability per byte")
+    parser.add_argument("--jitter", type=float, default=0.0, help="max extra delay per stream tick (s)")
+    parser.add_argument("--micros-start", type=int, default=0, help="initial micros() value")
+    parser.add_argument("--firmware", default="2.2", choices=["2.2", "2.3"], help="firmware behaviour to emulate")
+    args = parser.parse_args()
+
+    emu = TeensyEmulator(adc_rate=args.rate, corrupt_rate=args.corrupt, jitter=args.jitter,
+                         micros_start=args.micros_start,
+                         firmware=tuple(int(x) for x in args.firmware.split(".")))
+    print(f"Emulator listening on {emu.open_pty()}  (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(5)
+            print(emu.stats)
+    except KeyboardInterrupt:
+        emu.close()
@@ -0,0 +1,370 @@
+# === trajectory.py ===
+# Hardware-timed duty sequences: test steps are compiled into firmware
+# trajectory segments, which the control ISR plays back tick by tick, and
+# streamed while they play using the queue credits the device reports, so
+# the 16-entry device queue never overruns.
+#
+#   seq = compile_test_steps(tick_us, start_duties, start_times, ramp_times,
+#                            end_duties, end_times)
+#   TrajectoryPlayer(controller, seq).run()
+#
+# Needs firmware 2.3: earlier versions clear the queue on START_AUTOMATION
+# and never leave a step segment.
+import time
+from collections import deque
+
+import numpy as np
+
+from gui.logger import log
+from teensy_controller import parse_traj_state
+
+SHAPE_STEP = 0
+SHAPE_LINEAR = 1
+TRAJ_QUEUE_SLOTS = 15       # 16-entry ring, one slot always stays empty
+MAX_SEGMENT_US = 65000      # the duration field is uint16 microseconds
+MIN_RELEASE_SEGMENT_US = 5000
+MAX_POLL_S = 0.01
+STALL_TIMEOUT_S = 0.5        # no new segment started while running (segments are <= 65 ms)
+DEADLINE_MARGIN_S = 1.0      # slack on the time the device needs for everything sent
+HARDWARE_SEQUENCE_FIRMWARE = (2, 3)
+
+
+def supports_hardware_sequences(status):
+    """Whether the firmware in a get_status() dict can play queued sequences."""
+    try:
+        version = tuple(int(x) for x in str(status.get("firmware_version", "")).split("."))
+    except ValueError:
+        return False
+    return version >= HARDWARE_SEQUENCE_FIRMWARE
+
+
+def tick_us_for_rate(rate_hz):
+    """Control ISR period in microseconds, as the firmware derives it."""
+    return max(1, 1000000 // int(rate_hz))
+
+
+class TrajectorySequence:
+    """
+    Segments (start %, end %, duration us, shape) on the ISR tick grid.
+    Phase boundaries are rounded to whole ticks against the running total,
+    so rounding never accumulates over a long sequence. A segment outputs
+    its end value from its first tick (step) or reaches it on its last
+    tick (linear), so a zero-length ramp is simply an instant jump.
+    """
+
+    def __init__(self, tick_us):
+        self.tick_us = int(tick_us)
+        self.max_ticks = max(1, MAX_SEGMENT_US // self.tick_us)
+        self.segments = []
+        self.step_ticks = []  # tick at which each step starts
+        self.ticks = 0
+        self.time_s = 0.0
+        self.level = 0.0
+
+    @property
+    def duration(self):
+        return self.ticks * self.tick_us * 1e-6
+
+    @property
+    def step_times(self):
+        return [t * self.tick_us * 1e-6 for t in self.step_ticks]
+
+    def segment_starts(self):
+        """Playback start time of every segment, in seconds."""
+        durations = np.array([s[2] for s in self.segments], dtype=np.float64) * 1e-6
+        return np.concatenate(([0.0], np.cumsum(durations)[:-1])) if len(durations) else durations
+
+    def begin_step(self):
+        self.step_ticks.append(self.ticks)
+
+    def hold(self, percent, seconds):
+        self._emit(percent, percent, seconds, SHAPE_STEP)
+
+    def ramp(self, percent, seconds):
+        self._emit(self.level, percent, seconds, SHAPE_LINEAR)
+
+    def release(self, points, freq_hz, power):
+        """
+        Soft release from the current level to 0 %: `points` values of
+        level * (1 - k / points) ** power, one every 1 / freq_hz seconds,
+        joined by linear segments of at least MIN_RELEASE_SEGMENT_US.
+        """
+        points = int(points)
+        if points <= 0 or freq_hz <= 0:
+            self.hold(0.0, 0.0)
+            return
+        top = self.level
+        per_segment = max(1, int(np.ceil(MIN_RELEASE_SEGMENT_US * 1e-6 * freq_hz)))
+        prev = 0
+        for k in range(per_segment, points + per_segment, per_segment):
+            k = min(k, points)
+            self.ramp(top * (1.0 - k / points) ** power, (k - prev) / freq_hz)
+            prev = k
+
+    def finish(self, percent=0.0):
+        """End on a one-tick step so the output rests at percent afterwards."""
+        self._append(percent, percent, 1, SHAPE_STEP)
+        self.time_s = self.ticks * self.tick_us * 1e-6
+
+    def _emit(self, start, end, seconds, shape):
+        self.time_s += max(0.0, seconds)
+        target = int(round(self.time_s * 1e6 / self.tick_us))
+        ticks = target - self.ticks
+        if ticks <= 0:
+            self.level = end
+            return
+        done = 0
+        while done < ticks:
+            n = min(self.max_ticks, ticks - done)
+            a = start + (end - start) * done / ticks
+            b = start + (end - start) * (done + n) / ticks
+            self._append(a, b, n, shape)
+            done += n
+        self.level = end
+
+    def _append(self, start, end, ticks, shape):
+        self.segments.append((float(start), float(end), ticks * self.tick_us, shape))
+        self.ticks += ticks
+
+
+def compile_test_steps(tick_us, start_duties, start_times, ramp_times_ms, end_duties, end_times,
+                       release=None, pre_roll=0.0, post_roll=0.0):
+    """
+    Compile the test routine into one TrajectorySequence. Per step: hold
+    0 % for pre_roll, hold the start duty for its start time (s), ramp to
+    the end duty over its ramp time (ms), hold it for its end time (s),
+    then either the soft release (release = per-step (points, freq, power)
+    sequences) or, when there is a post roll, drop to 0 % for post_roll.
+    The sequence ends at 0 %.
+    """
+    seq = TrajectorySequence(tick_us)
+    for i in range(len(start_duties)):
+        seq.begin_step()
+        if pre_roll > 0:
+            seq.hold(0.0, pre_roll)
+        seq.hold(start_duties[i], start_times[i])
+        seq.ramp(end_duties[i], ramp_times_ms[i] / 1000.0)
+        seq.hold(end_duties[i], end_times[i])
+        if release is not None:
+            points, freq, power = (values[i] for values in release)
+            seq.release(points, freq, power)
+        if post_roll > 0:
+            seq.hold(0.0, post_roll)
+    seq.finish(0.0)
+    return seq
+
+
+class TrajectoryStreamer:
+    """
+    Feeds segments from a host-side queue of any length into the device
+    queue with credit-based flow control (firmware 2.3+). Every ACK of
+    QUEUE_TRAJ_SEG / START_AUTOMATION and every GET_TRAJ_STATUS reply says
+    how many slots are free, so exactly that many segments are sent, as
+    one pipelined batch. While the device queue is full the streamer polls
+    the status, at most every MAX_POLL_S and sooner when the segment that
+    frees the next slot is shorter, so it neither overruns the device nor
+    leaves slots idle for long.
+
+    Segments may be added from another thread while run() is going;
+    close() marks the end of the stream. If the device queue runs dry
+    before close() (the producer fell behind), the firmware stops
+    automation; the streamer restarts it once there is more to play,
+    counts an underrun and moves t0 forward by the stall, so t0 stays
+    the host time at which playback of the sequence would have started.
+
+    While the device plays, it must start a new segment at least every
+    STALL_TIMEOUT_S and finish everything sent by t0 plus its duration
+    plus DEADLINE_MARGIN_S; otherwise run() raises.
+
+    If a command fails or a timeout expires, automation is stopped before
+    the error is raised; segments the device did not accept are back at
+    the front of the host queue.
+    """
+
+    def __init__(self, controller, max_batch=TRAJ_QUEUE_SLOTS):
+        self.controller = controller
+        self.max_batch = max_batch
+        self.pending = deque()    # host side: (start %, end %, duration us, shape)
+        self.inflight = deque()   # durations (s) of segments sent but not started
+        self.closed = False
+        self.credits = 0
+        self.sent = 0
+        self.sent_us = 0          # total duration of the segments sent
+        self.played = 0
+        self.running = False
+        self.underruns = 0
+        self.polls = 0
+        self.t0 = None
+        self.progress_at = None   # host time at which played last changed
+        self.progress_played = 0
+
+    def put(self, segment):
+        self.pending.append(segment)
+
+    def extend(self, segments):
+        self.pending.extend(segments)
+
+    def close(self):
+        self.closed = True
+
+    def run(self, should_stop=None, on_poll=None):
+        """
+        Stream until the host queue is closed and the device has played
+        everything. should_stop() is polled and aborts playback
+        (STOP_AUTOMATION); on_poll() is called on every loop iteration.
+        Returns True when the whole stream played.
+        """
+        ctrl = self.controller
+        try:
+            # Start from an empty queue with the started-segment count at zero
+            self._update(ctrl.stop_automation_ack())
+            while True:
+                if should_stop is not None and should_stop():
+                    ctrl.stop_automation()
+                    self.running = False
+                    return False
+                if on_poll is not None:
+                    on_poll()
+
+                if self.pending and self.credits > 0:
+                    # Stopped means everything sent so far has played
+                    played_us = self.sent_us
+                    self._send(min(self.credits, self.max_batch, len(self.pending)))
+                    if not self.running:
+                        if self.t0 is not None:
+                            self.underruns += 1
+                            log.error(f"[Traj] Device queue ran dry after {self.played} segments; restarting")
+                        self._update(ctrl.start_automation_ack())
+                        # Anchor t0 so that t0 + played time is now, which
+                        # also moves it forward by the length of a stall
+                        self.t0 = time.monotonic() - played_us * 1e-6
+                        self.progress_at = time.monotonic()
+                        self.progress_played = self.played
+                    continue
+
+                if self.closed and not self.pending and not self.running:
+                    return True
+                time.sleep(self._poll_interval())
+                self._update(ctrl.get_traj_status())
+                self.polls += 1
+                self._check_progress()
+        except Exception:
+            self._abort()
+            raise
+
+    def _send(self, count):
+        ctrl = self.controller
+        segments = [self.pending.popleft() for _ in range(count)]
+        batch = ctrl.batch()
+        try:
+            with batch:
+                for start, end, duration_us, shape in segments:
+                    ctrl.queue_traj_segment_ack(start, end, duration_us / 1000.0, shape)
+        except Exception:
+            # The device queue is FIFO: only the segments up to the first
+            # failure are known to be queued; put the rest back in order
+            accepted = 0
+            for result in batch.results:
+                if not result["ok"]:
+                    break
+                accepted += 1
+            self._sent(segments[:accepted])
+            self.pending.extendleft(reversed(segments[accepted:]))
+            raise
+        self._sent(segments)
+        # The last ACK has the freshest queue state, including whether the
+        # device is still playing or ran dry before this batch arrived
+        self._update(parse_traj_state(batch.results[-1]["reply"][1:]))
+
+    def _sent(self, segments):
+        self.sent += len(segments)
+        self.sent_us += sum(seg[2] for seg in segments)
+        self.inflight.extend(seg[2] * 1e-6 for seg in segments)
+
+    def _abort(self):
+        # Never leave the device playing a stream the host gave up on
+        self.running = False
+        try:
+            self.controller.stop_automation()
+        except Exception as e:
+            log.error(f"[Traj] Could not stop automation: {e}")
+
+    def _update(self, state):
+        if state is None or state["running"] is None:
+            raise Exception("[Traj] Firmware did not report the trajectory queue state (needs 2.3)")
+        self.credits = state["free"]
+        started = state["played"] - self.played
+        for _ in range(min(started, len(self.inflight))):
+            self.inflight.popleft()
+        self.played = state["played"]
+        self.running = state["running"]
+
+    def _check_progress(self):
+        if not self.running:
+            return
+        now = time.monotonic()
+        if self.played != self.progress_played:
+            self.progress_played = self.played
+            self.progress_at = now
+        elif now - self.progress_at > STALL_TIMEOUT_S:
+            raise Exception(f"[Traj] Device stalled at segment {self.played} of {self.sent} "
+                            f"(nothing started for {STALL_TIMEOUT_S} s)")
+        if now > self.t0 + self.sent_us * 1e-6 + DEADLINE_MARGIN_S:
+            raise Exception(f"[Traj] Device is still playing {now - self.t0:.2f} s after the start, "
+                            f"the segments sent last {self.sent_us * 1e-6:.2f} s")
+
+    def _poll_interval(self):
+        if self.credits == 0 and self.inflight:
+            # The next slot frees when the playing segment ends; it is at
+            # most as long as the one queued next
+            return min(MAX_POLL_S, max(0.001, self.inflight[0] / 2))
+        return MAX_POLL_S
+
+
+class TrajectoryPlayer:
+    """
+    Plays a compiled TrajectorySequence through a TrajectoryStreamer and
+    reports step starts and progress against the host clock, anchored at
+    the START_AUTOMATION ACK and moved forward by any underrun stall.
+    """
+
+    def __init__(self, controller, sequence):
+        self.sequence = sequence
+        self.streamer = TrajectoryStreamer(controller)
+        self.streamer.extend(sequence.segments)
+        self.streamer.close()
+        self.next_step = 0
+
+    @property
+    def underruns(self):
+        return self.streamer.underruns
+
+    def elapsed(self):
+        t0 = self.streamer.t0
+        return 0.0 if t0 is None else time.monotonic() - t0
+
+    def run(self, should_stop=None, on_step=None, progress=None):
+        """
+        Play the sequence to the end. should_stop() is polled and aborts
+        playback; on_step(i) is called as step i starts and
+        progress(fraction) while it plays. Returns True when the whole
+        sequence played.
+        """
+        step_times = self.sequence.step_times
+        end = max(self.sequence.duration, 1e-9)
+
+        def on_poll():
+            if self.streamer.t0 is None:
+                return
+            elapsed = self.elapsed()
+            while self.next_step < len(step_times) and step_times[self.next_step] <= elapsed:
+                if on_step is not None:
+                    on_step(self.next_step)
+                self.next_step += 1
+            if progress is not None:
+                progress(min(1.0, elapsed / end))
+
+        completed = self.streamer.run(should_stop=should_stop, on_poll=on_poll)
+        if completed:
+            on_poll()
+        return completed